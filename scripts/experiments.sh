@@ -11,6 +11,12 @@ METRICS=all_score
 THRESHOLD=0.07
 CLASS_THRESHOLD=7
 
+# Columnar snapshot of the dataset, shared by all scripts below
+export SEARCH_ARENA_SNAPSHOT="$PATH_PREFIX/search-arena-v1-7k.arrow"
+if [ ! -f "$SEARCH_ARENA_SNAPSHOT" ]; then
+    python -m src.dataset_snapshot --output_path $SEARCH_ARENA_SNAPSHOT
+fi
+
 # Outputs aggregated results.jsonl and skips.json,
 # in addition to dumping per query nuggets and assignments.
 # Uses the two model completions and retrieved url contents as documents for nugget creation.
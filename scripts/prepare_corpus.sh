@@ -2,6 +2,12 @@
 
 PATH_PREFIX="" # ---> change it to your root path
 
+# Columnar snapshot of the dataset, shared by all scripts below
+export SEARCH_ARENA_SNAPSHOT="$PATH_PREFIX/search-arena-v1-7k.arrow"
+if [ ! -f "$SEARCH_ARENA_SNAPSHOT" ]; then
+    python -m src.dataset_snapshot --output_path $SEARCH_ARENA_SNAPSHOT
+fi
+
 # download urls
 if [ ! -d "$PATH_PREFIX/downloaded_files" ]; then
     echo "Creating directory: $PATH_PREFIX/downloaded_files"
@@ -36,6 +42,10 @@ python -m spacy download xx_sent_ud_sm
 python -m src.corpus_prepration.chunk_texts \
     --path_prefix $PATH_PREFIX
 
+# SimHash signatures for near-duplicate chunk removal (--dedup_chunks)
+python -m src.corpus_prepration.compute_chunk_signatures \
+    --path_prefix $PATH_PREFIX
+
 # Corpus indexing 
 python -m src.corpus_prepration.encode_urls_corpus \
     --path-prefix $PATH_PREFIX \
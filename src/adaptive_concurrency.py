@@ -0,0 +1,138 @@
+"""Additive-increase/multiplicative-decrease limit on concurrent LLM calls.
+
+The limiter is an llm_middleware middleware. Every successful call raises the
+limit by roughly one per limit's worth of calls, while a rate-limit or timeout
+response halves it and pauses new calls for as long as the server's retry-after
+hint asks. The limit therefore settles just below the point where the
+deployment starts pushing back, whatever the model's quota is.
+
+The state lives in multiprocessing shared memory, so one limiter passed to the
+workers of a process pool limits the calls of all of them together.
+"""
+
+import multiprocessing
+import re
+import time
+from email.utils import parsedate_to_datetime
+
+import openai
+
+OVERLOAD_ERRORS = (openai.RateLimitError, openai.APITimeoutError)
+RETRY_AFTER_PATTERN = re.compile(r"retry after (\d+) second", re.IGNORECASE)
+MAX_BACKOFF_SECONDS = 60.0
+
+
+def retry_after_seconds(error):
+    """Reads the server's retry-after hint from an openai error, if it has one."""
+    response = getattr(error, "response", None)
+    headers = response.headers if response is not None else {}
+    if "retry-after-ms" in headers:
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    if "retry-after" in headers:
+        value = headers["retry-after"]
+        try:
+            return float(value)
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+    # Azure also spells the hint out in the error message.
+    match = RETRY_AFTER_PATTERN.search(str(error))
+    return float(match.group(1)) if match else None
+
+
+class AIMDLimiter:
+    """Caps concurrent calls at a limit that adapts to overload responses.
+
+    The limit starts at initial_limit and grows by one per success until the
+    first overload (slow start), then by increase / limit per success. An
+    overload multiplies it by decrease, at most once for all calls that were
+    already in flight when it happened. Overloaded calls are retried up to
+    max_retries times before the error is raised to the caller.
+    """
+
+    def __init__(
+        self,
+        max_limit,
+        initial_limit=4,
+        min_limit=1,
+        increase=1.0,
+        decrease=0.5,
+        max_retries=8,
+        base_backoff=1.0,
+    ):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.increase = increase
+        self.decrease = decrease
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self._condition = multiprocessing.Condition()
+        self._limit = multiprocessing.RawValue(
+            "d", float(max(min_limit, min(initial_limit, max_limit)))
+        )
+        self._in_flight = multiprocessing.RawValue("i", 0)
+        self._paused_until = multiprocessing.RawValue("d", 0.0)
+        self._last_decrease = multiprocessing.RawValue("d", 0.0)
+        self._slow_start = multiprocessing.RawValue("b", 1)
+
+    @property
+    def limit(self):
+        return int(self._limit.value)
+
+    def _acquire(self):
+        with self._condition:
+            while True:
+                pause = self._paused_until.value - time.time()
+                if pause <= 0 and self._in_flight.value < int(self._limit.value):
+                    self._in_flight.value += 1
+                    return time.time()
+                self._condition.wait(pause if pause > 0 else None)
+
+    def _release(self, started, overloaded=False, succeeded=False, retry_after=None):
+        with self._condition:
+            self._in_flight.value -= 1
+            limit = self._limit.value
+            if overloaded:
+                now = time.time()
+                if started >= self._last_decrease.value:
+                    limit = max(self.min_limit, limit * self.decrease)
+                    self._last_decrease.value = now
+                    self._slow_start.value = 0
+                if retry_after:
+                    self._paused_until.value = max(
+                        self._paused_until.value, now + retry_after
+                    )
+            elif succeeded:
+                step = 1.0 if self._slow_start.value else self.increase / limit
+                limit = min(self.max_limit, limit + step)
+            self._limit.value = limit
+            self._condition.notify_all()
+
+    def middleware(self, create):
+        def limited_create(*args, **kwargs):
+            for attempt in range(self.max_retries + 1):
+                started = self._acquire()
+                try:
+                    response = create(*args, **kwargs)
+                except OVERLOAD_ERRORS as e:
+                    retry_after = retry_after_seconds(e)
+                    self._release(started, overloaded=True, retry_after=retry_after)
+                    if attempt == self.max_retries:
+                        raise
+                    if retry_after is None:
+                        time.sleep(
+                            min(MAX_BACKOFF_SECONDS, self.base_backoff * 2**attempt)
+                        )
+                    continue
+                except BaseException:
+                    self._release(started)
+                    raise
+                self._release(started, succeeded=True)
+                return response
+
+        return limited_create
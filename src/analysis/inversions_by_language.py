@@ -3,8 +3,8 @@ import json
 import os
 
 import pandas as pd
-from datasets import load_dataset
 
+from src.dataset_snapshot import load_arena_df
 from src.utils import load_inversion_ids
 
 
@@ -40,7 +40,7 @@ def main():
     args = parser.parse_args()
 
     inversion_by_lang, metadata = load_inversion_ids(args.path_prefix)
-    dataset_df = load_dataset("lmarena-ai/search-arena-v1-7k", split="test").to_pandas()
+    dataset_df = load_arena_df(["question_id", "language"])
     jsonl_df = pd.read_json(os.path.join(args.path_prefix, "results.jsonl"), lines=True)
 
     percentage = compute_language_percentages(inversion_by_lang, dataset_df, jsonl_df)
@@ -5,6 +5,9 @@ import openai
 import tiktoken
 from openai import AzureOpenAI
 
+from src.adaptive_concurrency import retry_after_seconds
+from src.llm_middleware import wrap_chat_completions
+
 ## As of March 12, 2025
 OPENAI_PRICING = {
     "gpt-4o-mini": {"input": 0.15 / 1000000, "output": 0.6 / 1000000},
@@ -42,9 +45,15 @@ class OpenAIClient:
         api_key: str = None,
         api_version: str = None,
         wait: int = 10,
+        max_retries: int = 10,
+        timeout: float = None,
+        http_client=None,
+        sdk_max_retries: int = openai.DEFAULT_MAX_RETRIES,
+        middlewares=(),
     ):
         self.deployment_name = model_name_or_path
         self.wait = wait
+        self.max_retries = max_retries
         print(f"Initializing OpenAI API Client: {model_name_or_path}")
         self.client = AzureOpenAI(
             azure_endpoint=(
@@ -56,9 +65,16 @@ class OpenAIClient:
                 if api_version is None
                 else api_version
             ),
+            # Pass a src.llm_middleware.build_http_client pool to share connections.
+            http_client=http_client,
+            # Set to 0 when an AIMD limiter middleware retries overloaded calls.
+            max_retries=sdk_max_retries,
+            timeout=openai.DEFAULT_TIMEOUT if timeout is None else timeout,
         )
         self.price = OPENAI_PRICING[model_name_or_path]
         self.tokenizer = tiktoken.get_encoding(TOKENIZER_OPENAI[model_name_or_path])
+        # src.llm_middleware middlewares around every call, outermost first.
+        wrap_chat_completions(self.client, *middlewares)
 
     def count_tokens(self, text):
         # Encode the text (convert the text to tokens)
@@ -89,54 +105,51 @@ class OpenAIClient:
         disable_logging: bool = False,
         **kwargs,
     ):
-        try:
-            if not disable_logging:
-                generation_config = {
-                    "max_tokens": max_tokens,
-                    "temperature": temperature,
-                    "max_completion_tokens": max_tokens,
-                    "n": n,
-                }
-                print(f"OpenAI generation config: {generation_config}")
-
-            if self.deployment_name in ["o3-mini", "o1"]:
-                # No temperature parameter for this model.
-                response = self.client.chat.completions.create(
-                    model=self.deployment_name,  # model = "deployment_name".
-                    messages=[{"role": "user", "content": f"{prompt}"}],
-                    max_completion_tokens=max_tokens,
-                )
-                return response
+        if not disable_logging:
+            generation_config = {
+                "max_tokens": max_tokens,
+                "temperature": temperature,
+                "max_completion_tokens": max_tokens,
+                "n": n,
+            }
+            print(f"OpenAI generation config: {generation_config}")
+
+        if self.deployment_name in ["o3-mini", "o1"]:
+            # No temperature parameter for this model.
+            request = {"max_completion_tokens": max_tokens}
+        else:
+            request = {
+                "temperature": temperature,
+                "max_completion_tokens": max_tokens,
+                "n": n,
+                **kwargs,
+            }
 
-            else:
-                response = self.client.chat.completions.create(
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self.client.chat.completions.create(
                     model=self.deployment_name,  # model = "deployment_name".
                     messages=[{"role": "user", "content": f"{prompt}"}],
-                    temperature=temperature,
-                    max_completion_tokens=max_tokens,
-                    n=n,
-                    **kwargs,
+                    **request,
                 )
-                return response
 
-        except openai.RateLimitError as e:
-            retry_time = int(str(e).split("retry after")[1].split("second")[0].strip())
-            print(
-                f"Rate limit exceeded. Retrying after waiting for {retry_time + 2} seconds..."
-            )
-            time.sleep(retry_time + 2)
-            return self.response(
-                prompt, temperature, max_tokens, n, disable_logging, **kwargs
-            )
+            except openai.RateLimitError as e:
+                if attempt == self.max_retries:
+                    raise
+                retry_time = retry_after_seconds(e)
+                retry_time = self.wait if retry_time is None else retry_time + 2
+                print(
+                    f"Rate limit exceeded. Retrying after waiting for {retry_time} seconds..."
+                )
+                time.sleep(retry_time)
 
-        except openai.InternalServerError:
-            print(
-                f"Internal server error. Retrying after waiting for {self.wait} seconds..."
-            )
-            time.sleep(self.wait)
-            return self.response(
-                prompt, temperature, max_tokens, n, disable_logging, **kwargs
-            )
+            except openai.InternalServerError:
+                if attempt == self.max_retries:
+                    raise
+                print(
+                    f"Internal server error. Retrying after waiting for {self.wait} seconds..."
+                )
+                time.sleep(self.wait)
 
     def __call__(
         self,
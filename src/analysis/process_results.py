@@ -3,9 +3,8 @@ import json
 import os
 from collections import defaultdict
 
-from datasets import load_dataset
-
-from src.utils import Metric, get_prompt
+from src.dataset_snapshot import load_arena_df
+from src.utils import Metric, load_results, load_skip_logs
 
 
 def main():
@@ -38,14 +37,12 @@ def main():
     per_language_stats = {}
     per_language_inversions = {}
     diagram_candidates = {}
-    data = []
     threshold = args.inversion_threshold
 
-    input_df = load_dataset("lmarena-ai/search-arena-v1-7k", split="test").to_pandas()
+    input_df = load_arena_df(["language", "prompt"])
 
-    with open(os.path.join(args.path_prefix, "results.jsonl"), "r") as f:
-        for l in f:
-            data.append(json.loads(l))
+    # Tolerates a run that is still streaming its results.
+    data = load_results(args.path_prefix)
 
     for row in data:
         id = row["question_id"]
@@ -79,7 +76,7 @@ def main():
                 if metric_name == inversion_metric and lang == candidates_language:
                     if diff not in diagram_candidates:
                         diagram_candidates[diff] = []
-                    diagram_candidates[diff].append((id, get_prompt(input_df.iloc[id])))
+                    diagram_candidates[diff].append((id, input_df.iloc[id]["prompt"]))
             else:
                 stats[f"{metric_name}_inversions"] += 1
                 per_language_stats[lang][f"{metric_name}_inversions"] += 1
@@ -88,15 +85,14 @@ def main():
                 if diff not in per_language_inversions[lang]:
                     per_language_inversions[lang][diff] = []
                 per_language_inversions[lang][diff].append(
-                    (id, get_prompt(input_df.iloc[id]))
+                    (id, input_df.iloc[id]["prompt"])
                 )
 
         inversion_metric = args.inversion_metric.value
         for metric in Metric:
             update_stats(metric.value, inversion_metric, args.candidates_language)
 
-    with open(os.path.join(args.path_prefix, "skips.json"), "r") as in_f:
-        skip_data = json.load(in_f)
+    skip_data = load_skip_logs(args.path_prefix)
 
     with open(os.path.join(args.path_prefix, "count_stats.json"), "w") as out_f:
         json.dump(
@@ -17,10 +17,19 @@ python -m openai_categorization \
 
 import random
 
+import tiktoken
 from datasets import load_dataset
 from tqdm.autonotebook import tqdm
 
-from .openai_client import OpenAIClient
+from src.batch_api import BatchDeferred, BatchItemFailed, build_batch_runner
+from src.budget import BudgetGovernor
+from src.deployment_pool import load_deployment_pool
+from src.hedging import Hedger, summarize_hedging
+from src.llm_cache import LLMCache
+from src.llm_trace import CallTracer, summarize_trace
+from src.rate_limiter import RateLimiter
+
+from .openai_client import OPENAI_PRICING, TOKENIZER_OPENAI, OpenAIClient
 
 random.seed(42)
 
@@ -29,6 +38,8 @@ import ast
 import json
 import logging
 import os
+import shutil
+import tempfile
 
 PROMPT = """
 Given the question: {question}
@@ -54,6 +65,91 @@ def main():
     parser.add_argument("--output_file_save", type=str, required=False, default=None)
     parser.add_argument("--temperature", type=float, default=0.7)
     parser.add_argument("--max_completion_tokens", type=int, default=512)
+    parser.add_argument(
+        "--cache_path",
+        type=str,
+        default=None,
+        help="SQLite file for caching LLM responses across runs",
+    )
+    parser.add_argument("--cache_max_gb", type=float, default=10.0)
+    parser.add_argument(
+        "--replay_only",
+        action="store_true",
+        help="Only serve responses from --cache_path and fail on any cache miss",
+    )
+    parser.add_argument(
+        "--deployments_config",
+        type=str,
+        default=None,
+        help="JSON list of Azure OpenAI deployments to balance calls over, see src/deployment_pool.py",
+    )
+    parser.add_argument(
+        "--requests_per_minute",
+        type=int,
+        default=None,
+        help="Requests per minute quota of the deployment, shared with other runs using --rate_limit_dir",
+    )
+    parser.add_argument(
+        "--tokens_per_minute",
+        type=int,
+        default=None,
+        help="Tokens per minute quota of the deployment, shared with other runs using --rate_limit_dir",
+    )
+    parser.add_argument(
+        "--rate_limit_dir",
+        type=str,
+        default=os.path.join(tempfile.gettempdir(), "lmsys_nuggetize_rate_limits"),
+    )
+    parser.add_argument(
+        "--call_timeout",
+        type=float,
+        default=None,
+        help="Deadline in seconds for each call",
+    )
+    parser.add_argument(
+        "--hedge_percentile",
+        type=float,
+        default=None,
+        help="Send a duplicate request for calls slower than this latency percentile",
+    )
+    parser.add_argument("--max_hedge_rate", type=float, default=0.05)
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="Send the prompts through the Batch API; results are kept in --cache_path",
+    )
+    parser.add_argument(
+        "--batch_backend",
+        type=str,
+        choices=["openai", "local", "canned"],
+        default="openai",
+    )
+    parser.add_argument(
+        "--batch_responses_dir",
+        type=str,
+        default=None,
+        help="Recorded *.output.jsonl batch results answering --batch_backend canned",
+    )
+    parser.add_argument("--batch_poll_seconds", type=float, default=60.0)
+    parser.add_argument("--batch_deployment_suffix", type=str, default="")
+    parser.add_argument(
+        "--max_cost",
+        type=float,
+        default=None,
+        help="Stop sending queries once the projected cost in USD would exceed this",
+    )
+    parser.add_argument(
+        "--max_hours",
+        type=float,
+        default=None,
+        help="Stop sending queries once the projected wall-clock time would exceed this",
+    )
+    parser.add_argument(
+        "--trace_path",
+        type=str,
+        default=None,
+        help="Append-only trace with one record per call, defaults to output_dir/llm_trace.jsonl",
+    )
     args = parser.parse_args()
 
     ### Download scifact.zip dataset and unzip the dataset
@@ -63,7 +159,74 @@ def main():
     print(f"Loading the test dataset ({args.train_dataset})): {len(hf_dataset)}")
 
     ### load the OpenAI client
-    client = OpenAIClient(model_name_or_path=args.model_name_or_path)
+    cache = None
+    if args.batch and not args.cache_path:
+        args.cache_path = os.path.join(args.output_dir, "batches/llm_cache.sqlite")
+    if args.cache_path:
+        cache = LLMCache(
+            args.cache_path,
+            max_size_bytes=int(args.cache_max_gb * 1024**3),
+            replay_only=args.replay_only,
+        )
+    rate_limiter = None
+    if args.requests_per_minute or args.tokens_per_minute:
+        encoding = tiktoken.get_encoding(TOKENIZER_OPENAI[args.model_name_or_path])
+        rate_limiter = RateLimiter(
+            args.rate_limit_dir,
+            requests_per_minute=args.requests_per_minute,
+            tokens_per_minute=args.tokens_per_minute,
+            count_tokens=lambda text: len(encoding.encode(text, disallowed_special=())),
+        )
+    budget = None
+    if args.max_cost or args.max_hours:
+        pricing_name = args.model_name_or_path
+        if args.batch and f"{pricing_name}-batch" in OPENAI_PRICING:
+            pricing_name = f"{pricing_name}-batch"
+        budget = BudgetGovernor(
+            {args.model_name_or_path: OPENAI_PRICING[pricing_name]},
+            max_cost=args.max_cost,
+            max_hours=args.max_hours,
+        )
+    tracer = CallTracer(
+        args.trace_path or os.path.join(args.output_dir, "llm_trace.jsonl")
+    )
+    batch_runner = None
+    if args.batch:
+        batch_runner = build_batch_runner(
+            cache,
+            args.batch_backend,
+            os.path.join(args.output_dir, "batches"),
+            responses_dir=args.batch_responses_dir,
+            poll_seconds=args.batch_poll_seconds,
+            deployment_suffix=args.batch_deployment_suffix,
+            budget=budget,
+            tracer=tracer,
+        )
+    hedger = None
+    if args.hedge_percentile:
+        hedger = Hedger(
+            hedge_percentile=args.hedge_percentile,
+            max_hedge_rate=args.max_hedge_rate,
+        )
+    deployment_pool = (
+        load_deployment_pool(args.deployments_config, rate_limiter=rate_limiter)
+        if args.deployments_config
+        else None
+    )
+    client = OpenAIClient(
+        model_name_or_path=args.model_name_or_path,
+        timeout=args.call_timeout,
+        middlewares=[
+            cache.middleware if cache else None,
+            tracer.middleware,
+            hedger.middleware if hedger else None,
+            budget.middleware if budget else None,
+            # A pool paces each of its deployments itself.
+            rate_limiter.middleware if rate_limiter and not deployment_pool else None,
+            deployment_pool.middleware if deployment_pool else None,
+            batch_runner.middleware if batch_runner else None,
+        ],
+    )
     print(f"Using model: {args.model_name_or_path}")
 
     ### Create the output directory
@@ -96,48 +259,87 @@ def main():
     ### Save the queries to a file
 
     with open(output_filepath, "a", encoding="utf-8") as f:
-        for query, question_ids in tqdm(
-            queries_to_dict.items(),
-            total=len(queries_to_dict),
-            desc="Processing Queries",
-        ):
-            if query in finished_queries:
-                continue
-
-            output_text = None
-
-            try:
-                prompt = PROMPT.format(question=query)
-                output = client.response(
-                    prompt=prompt,
-                    temperature=args.temperature,
-                    max_tokens=args.max_completion_tokens,
-                    n=1,
-                    disable_logging=True,
-                )
-
-                output_text = output.choices[0].message.content
-                if "python" in output_text:
-                    output_text = output_text.replace("```python", "").replace(
-                        "```", ""
-                    )
-
-                output_dict = ast.literal_eval(output_text.strip())
-
-                for question_id in question_ids:
-                    example = {
-                        "question_id": question_id,
-                        "query": query,
-                        "categories": output_dict,
-                    }
-                    ## save the example to the output directory
-                    f.write(json.dumps(example, ensure_ascii=False) + "\n")
-                    f.flush()
-
-            except Exception as e:
-                print(f"Error processing query: {query}, output: {output_text}")
-                print(f"Error: {e}")
-                continue
+        # In batch mode, each pass defers uncached prompts to the next batch.
+        while True:
+            for query, question_ids in tqdm(
+                queries_to_dict.items(),
+                total=len(queries_to_dict),
+                desc="Processing Queries",
+            ):
+                if query in finished_queries:
+                    continue
+                if budget is not None and not budget.allows(0):
+                    break
+
+                output_text = None
+
+                try:
+                    prompt = PROMPT.format(question=query)
+                    with tracer.context(
+                        question_id=question_ids[0], stage="categorization"
+                    ):
+                        output = client.response(
+                            prompt=prompt,
+                            temperature=args.temperature,
+                            max_tokens=args.max_completion_tokens,
+                            n=1,
+                            disable_logging=True,
+                        )
+
+                    output_text = output.choices[0].message.content
+                    if "python" in output_text:
+                        output_text = output_text.replace("```python", "").replace(
+                            "```", ""
+                        )
+
+                    output_dict = ast.literal_eval(output_text.strip())
+
+                    for question_id in question_ids:
+                        example = {
+                            "question_id": question_id,
+                            "query": query,
+                            "categories": output_dict,
+                        }
+                        ## save the example to the output directory
+                        f.write(json.dumps(example, ensure_ascii=False) + "\n")
+                        f.flush()
+                    finished_queries.add(query)
+                    if budget is not None:
+                        budget.finish_row()
+
+                except BatchDeferred:
+                    continue
+
+                except BatchItemFailed as e:
+                    print(f"Error processing query: {query}")
+                    print(f"Error: {e}")
+                    continue
+
+                except Exception as e:
+                    print(f"Error processing query: {query}, output: {output_text}")
+                    print(f"Error: {e}")
+                    continue
+
+            if batch_runner is None or batch_runner.num_pending == 0:
+                break
+            if budget is not None and not budget.allows(0):
+                break
+            batch_runner.run_round()
+
+    if budget is not None:
+        remaining = len(queries_to_dict) - len(finished_queries)
+        print(f"Budget: {json.dumps(budget.summary(remaining))}")
+        if budget.stopped:
+            print(f"Budget reached with {remaining} queries left; rerun to continue")
+
+    if os.path.exists(tracer.path):
+        print(f"LLM calls: {json.dumps(summarize_trace(tracer.path))}")
+
+    if hedger is not None:
+        hedging_dir = os.path.join(args.output_dir, "hedging")
+        shutil.rmtree(hedging_dir, ignore_errors=True)
+        hedger.dump(hedging_dir)
+        print(f"Hedging: {json.dumps(summarize_hedging(hedging_dir))}")
 
 
 if __name__ == "__main__":
@@ -3,9 +3,8 @@ import json
 import os
 from collections import defaultdict
 
-from datasets import load_dataset
-
-from src.utils import get_prompt, load_skips
+from src.dataset_snapshot import load_arena_df
+from src.utils import load_skips
 
 
 def main():
@@ -33,7 +32,7 @@ def main():
     )
     args = parser.parse_args()
 
-    input_df = load_dataset("lmarena-ai/search-arena-v1-7k", split="test").to_pandas()
+    input_df = load_arena_df(["question_id", "language", "prompt"])
     input_df = input_df.set_index("question_id")
 
     skips = load_skips(args.path_prefix)
@@ -51,7 +50,7 @@ def main():
             if lang != args.language:
                 continue
 
-            prompt = get_prompt(row)
+            prompt = row["prompt"]
 
             max_rate = max(data["categories"].values())
             max_cat = [
@@ -0,0 +1,121 @@
+"""Nugget assignment by a cheap model, escalating uncertain nuggets.
+
+The cheap model labels every nugget, optionally drawing several samples in one
+request. A nugget is escalated to the strong model's Nuggetizer.assign when the
+cheap model calls it partial_support, when its samples disagree, when an
+answer cannot be parsed into valid labels, or when the cheap call fails. On
+held-out rows the strong model also labels every nugget, which is used as the
+result and to measure how often the cascade agrees with it.
+"""
+
+import ast
+
+from nuggetizer.core.types import AssignedScoredNugget
+
+from src.joint_assignment import LABELS
+
+UNCERTAIN_LABELS = {"partial_support"}
+SAMPLE_TEMPERATURE = 0.7
+
+
+def parse_labels(response, num_nuggets, valid_labels):
+    response = response.replace("```python", "").replace("```", "").strip()
+    try:
+        labels = ast.literal_eval(response)
+    except (ValueError, SyntaxError):
+        return None
+    if not isinstance(labels, list) or len(labels) != num_nuggets:
+        return None
+    labels = [str(label).strip().lower() for label in labels]
+    if any(label not in valid_labels for label in labels):
+        return None
+    return labels
+
+
+def sample_labels(nuggetizer, query, context, nuggets, samples):
+    """Returns one label per nugget, or None for nuggets that need escalation."""
+    labels = []
+    llm = nuggetizer.assigner_llm
+    valid_labels = LABELS[nuggetizer.assigner_mode]
+    for start in range(0, len(nuggets), nuggetizer.assigner_window_size):
+        window = nuggets[start : start + nuggetizer.assigner_window_size]
+        try:
+            # Same prompt as Nuggetizer.assign, with all samples in one request.
+            completion = llm.client.chat.completions.create(
+                model=llm.model,
+                messages=nuggetizer._create_assign_prompt(query, context, window),
+                temperature=SAMPLE_TEMPERATURE if samples > 1 else 0.0,
+                max_completion_tokens=2048,
+                n=samples,
+            )
+        except Exception as e:
+            # The strong model's assign retries on its own; escalate the window.
+            print(f"Cascade call failed, escalating {len(window)} nuggets: {e}")
+            labels.extend([None] * len(window))
+            continue
+        parsed = [
+            parse_labels(choice.message.content or "", len(window), valid_labels)
+            for choice in completion.choices
+        ]
+        if any(sample is None for sample in parsed):
+            labels.extend([None] * len(window))
+            continue
+        for nugget_labels in zip(*parsed):
+            certain = (
+                len(set(nugget_labels)) == 1
+                and nugget_labels[0] not in UNCERTAIN_LABELS
+            )
+            labels.append(nugget_labels[0] if certain else None)
+    return labels
+
+
+def cascade_assign(cheap, strong, query, context, nuggets, samples=1, holdout=False):
+    """Assigns nuggets to context with the cheap Nuggetizer, escalating to strong.
+
+    Returns the assigned nuggets and stats with the number of nuggets, how many
+    were escalated and, on held-out rows, how many the cascade got right.
+    """
+    if not context.strip():
+        return strong.assign(query, context, nuggets), {
+            "nuggets": len(nuggets),
+            "escalated": 0,
+        }
+    labels = sample_labels(cheap, query, context, nuggets, samples)
+    uncertain = [i for i, label in enumerate(labels) if label is None]
+    if uncertain:
+        escalated = strong.assign(query, context, [nuggets[i] for i in uncertain])
+        for i, assigned in zip(uncertain, escalated):
+            labels[i] = assigned.assignment
+    stats = {"nuggets": len(nuggets), "escalated": len(uncertain)}
+    if holdout:
+        reference = strong.assign(query, context, nuggets)
+        stats["holdout_agreement"] = sum(
+            label == assigned.assignment for label, assigned in zip(labels, reference)
+        )
+        return reference, stats
+    assigned = [
+        AssignedScoredNugget(
+            text=nugget.text, importance=nugget.importance, assignment=label
+        )
+        for nugget, label in zip(nuggets, labels)
+    ]
+    return assigned, stats
+
+
+def summarize_cascade(stats):
+    """Combines the per-completion stats of a run into rates."""
+    nuggets = sum(s["nuggets"] for s in stats)
+    escalated = sum(s["escalated"] for s in stats)
+    holdout = [s for s in stats if "holdout_agreement" in s]
+    holdout_nuggets = sum(s["nuggets"] for s in holdout)
+    return {
+        "nuggets": nuggets,
+        "escalated": escalated,
+        "escalation_rate": escalated / max(1, nuggets),
+        "holdout_nuggets": holdout_nuggets,
+        "holdout_agreement": (
+            sum(s["holdout_agreement"] for s in holdout) / holdout_nuggets
+            if holdout_nuggets
+            else None
+        ),
+    }
@@ -0,0 +1,308 @@
+"""Runs LLM calls through the (half-price) Batch API in rounds.
+
+Batch mode reuses the normal synchronous code paths. A BatchRunner is installed
+as the innermost llm_middleware, behind an LLMCache: a call whose response is
+cached is served as usual, while any other call is recorded and aborted with
+BatchDeferred. A round therefore runs every pending row until its first
+uncached call, submits the recorded requests as batch JSONL files, and stores
+the results in the cache, so the next round gets one call further. Rows whose
+calls depend on each other, like Nuggetizer's iterative nugget creation, simply
+take several rounds. Requests that failed are resubmitted in later rounds until
+they fail max_attempts times, after which the call raises BatchItemFailed.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import Counter
+
+from openai import AzureOpenAI
+from openai.types.chat import ChatCompletion
+
+from src.llm_cache import IGNORED_REQUEST_KEYS
+from src.llm_middleware import LLMCallAborted
+
+# OpenAI's per-file limit on the number of batch requests.
+MAX_BATCH_REQUESTS = 50000
+FINAL_BATCH_STATES = {"completed", "failed", "expired", "cancelled"}
+
+
+class BatchDeferred(LLMCallAborted):
+    """The call was queued for the next batch; retry the row after it."""
+
+
+class BatchItemFailed(LLMCallAborted):
+    """The call failed in max_attempts batches."""
+
+
+def azure_client_from_env():
+    return AzureOpenAI(
+        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+        api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+        api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
+    )
+
+
+def output_path(input_path):
+    return input_path.replace(".jsonl", ".output.jsonl")
+
+
+def read_batch_output(path):
+    """Yields (custom_id, response body or None, error) from a batch output file."""
+    with open(path, "r") as f:
+        for line in f:
+            item = json.loads(line)
+            response = item.get("response") or {}
+            if response.get("status_code") == 200:
+                yield item["custom_id"], response["body"], None
+            else:
+                yield item["custom_id"], None, item.get("error") or response
+
+
+class OpenAIBatchBackend:
+    """Submits batch files to the OpenAI/Azure OpenAI Batch API."""
+
+    def __init__(self, client, completion_window="24h"):
+        self.client = client
+        self.completion_window = completion_window
+
+    def submit(self, input_path):
+        with open(input_path, "rb") as f:
+            input_file = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/chat/completions",
+            completion_window=self.completion_window,
+        )
+        return batch.id
+
+    def status(self, batch_id):
+        return self.client.batches.retrieve(batch_id).status
+
+    def download(self, batch_id, path):
+        batch = self.client.batches.retrieve(batch_id)
+        with open(path, "w") as f:
+            for file_id in [batch.output_file_id, batch.error_file_id]:
+                if file_id:
+                    f.write(self.client.files.content(file_id).text)
+
+
+class LocalBatchBackend:
+    """Stand-in backend that processes batch files itself with a create callable.
+
+    With a real client's chat.completions.create it behaves like the Batch API
+    at synchronous prices, so it still needs credentials and network access.
+    """
+
+    def __init__(self, create):
+        self.create = create
+
+    def submit(self, input_path):
+        with open(input_path, "r") as f, open(output_path(input_path), "w") as out:
+            for line in f:
+                item = json.loads(line)
+                try:
+                    body = self.create(**item["body"]).model_dump()
+                    result = {"status_code": 200, "body": body}
+                    error = None
+                except Exception as e:
+                    result = None
+                    error = {"message": repr(e)}
+                out.write(
+                    json.dumps(
+                        {
+                            "custom_id": item["custom_id"],
+                            "response": result,
+                            "error": error,
+                        },
+                        ensure_ascii=False,
+                    )
+                    + "\n"
+                )
+        return input_path
+
+    def status(self, batch_id):
+        return "completed"
+
+    def download(self, batch_id, path):
+        assert path == output_path(batch_id)
+
+
+class CannedBatchBackend(LocalBatchBackend):
+    """Offline backend that answers batch requests with recorded responses.
+
+    Responses are looked up by custom_id, the request's cache key, in the
+    *.output.jsonl files of responses_dir, such as the batches/ directory of an
+    earlier run. Requests without a recorded response fail.
+    """
+
+    def __init__(self, responses_dir):
+        responses = {}
+        for name in sorted(os.listdir(responses_dir)):
+            if name.endswith(".output.jsonl"):
+                path = os.path.join(responses_dir, name)
+                for key, body, _ in read_batch_output(path):
+                    if body is not None:
+                        responses[key] = body
+        super().__init__(None)
+        self.responses = responses
+
+    def submit(self, input_path):
+        with open(input_path, "r") as f, open(output_path(input_path), "w") as out:
+            for line in f:
+                key = json.loads(line)["custom_id"]
+                body = self.responses.get(key)
+                item = {"custom_id": key, "response": None, "error": None}
+                if body is None:
+                    item["error"] = {"message": "No recorded response"}
+                else:
+                    item["response"] = {"status_code": 200, "body": body}
+                out.write(json.dumps(item, ensure_ascii=False) + "\n")
+        return input_path
+
+
+class BatchRunner:
+    """Collects uncached calls and resolves them through batch rounds."""
+
+    def __init__(
+        self,
+        cache,
+        backend,
+        batch_dir,
+        max_attempts=3,
+        poll_seconds=60.0,
+        deployment_suffix="",
+        budget=None,
+        tracer=None,
+    ):
+        self.cache = cache
+        self.backend = backend
+        self.batch_dir = batch_dir
+        self.max_attempts = max_attempts
+        self.poll_seconds = poll_seconds
+        self.deployment_suffix = deployment_suffix
+        # An optional src.budget.BudgetGovernor charged with the batch results.
+        self.budget = budget
+        # An optional src.llm_trace.CallTracer recording the batch results.
+        self.tracer = tracer
+        self.rounds = 0
+        self.failures = Counter()
+        self._pending = {}
+        # The tracer fields of the row that deferred each pending call.
+        self._trace_fields = {}
+        self._lock = threading.Lock()
+        os.makedirs(batch_dir, exist_ok=True)
+
+    def middleware(self, create):
+        def deferred_create(**request):
+            key = self.cache.attempt_key(request)
+            if self.failures[key] >= self.max_attempts:
+                raise BatchItemFailed(
+                    f"{request.get('model')} request {key} failed in "
+                    f"{self.failures[key]} batches"
+                )
+            with self._lock:
+                self._pending[key] = {
+                    k: v for k, v in request.items() if k not in IGNORED_REQUEST_KEYS
+                }
+                if self.tracer is not None:
+                    self._trace_fields[key] = self.tracer.fields()
+            raise BatchDeferred(key)
+
+        return deferred_create
+
+    @property
+    def num_pending(self):
+        return len(self._pending)
+
+    def write_batch_files(self):
+        paths = []
+        items = list(self._pending.items())
+        for start in range(0, len(items), MAX_BATCH_REQUESTS):
+            path = os.path.join(
+                self.batch_dir,
+                f"round_{self.rounds}_part_{start // MAX_BATCH_REQUESTS}.jsonl",
+            )
+            with open(path, "w") as f:
+                for key, request in items[start : start + MAX_BATCH_REQUESTS]:
+                    body = dict(request)
+                    body["model"] = f"{body['model']}{self.deployment_suffix}"
+                    line = {
+                        "custom_id": key,
+                        "method": "POST",
+                        "url": "/chat/completions",
+                        "body": body,
+                    }
+                    f.write(json.dumps(line, ensure_ascii=False) + "\n")
+            paths.append(path)
+        return paths
+
+    def run_round(self):
+        """Submits the pending calls, waits for them and caches the results.
+
+        Returns the number of calls that succeeded and failed in this round.
+        """
+        started = time.time()
+        submitted = {
+            path: self.backend.submit(path) for path in self.write_batch_files()
+        }
+        print(
+            f"Batch round {self.rounds}: submitted {len(self._pending)} requests "
+            f"in {len(submitted)} files"
+        )
+        for path, batch_id in submitted.items():
+            while (status := self.backend.status(batch_id)) not in FINAL_BATCH_STATES:
+                print(f"Batch {batch_id} is {status}, waiting...")
+                time.sleep(self.poll_seconds)
+            if status != "completed":
+                print(f"Batch {batch_id} ended as {status}")
+            self.backend.download(batch_id, output_path(path))
+
+        succeeded = 0
+        for path in submitted:
+            for key, body, error in read_batch_output(output_path(path)):
+                request = self._pending.pop(key, None)
+                if request is None:
+                    continue
+                if body is None:
+                    print(f"Batch request {key} failed: {error}")
+                    self._pending[key] = request
+                    continue
+                response = ChatCompletion.model_validate(body)
+                self.cache.put(key, request.get("model"), response.model_dump_json())
+                if self.budget is not None:
+                    self.budget.charge(request.get("model"), response.usage)
+                self.trace(key, request, started, usage=response.usage)
+                succeeded += 1
+        # Anything without a successful result is resubmitted by the next round.
+        for key, request in self._pending.items():
+            self.trace(key, request, started, error="BatchItemError")
+            self.failures[key] += 1
+        failed = len(self._pending)
+        self._pending.clear()
+        self._trace_fields.clear()
+        self.rounds += 1
+        return succeeded, failed
+
+    def trace(self, key, request, started, usage=None, error=None):
+        if self.tracer is None:
+            return
+        self.tracer.write_call(
+            self._trace_fields.get(key, self.tracer.fields()),
+            request.get("model"),
+            started,
+            self.failures[key],
+            usage=usage,
+            error=error,
+        )
+
+
+def build_batch_runner(cache, backend_name, batch_dir, responses_dir=None, **kwargs):
+    if backend_name == "canned":
+        backend = CannedBatchBackend(responses_dir)
+    elif backend_name == "local":
+        backend = LocalBatchBackend(azure_client_from_env().chat.completions.create)
+    else:
+        backend = OpenAIBatchBackend(azure_client_from_env())
+    return BatchRunner(cache, backend, batch_dir, **kwargs)
@@ -0,0 +1,117 @@
+"""Stops dispatching rows before a run crosses its cost or wall-clock budget.
+
+A BudgetGovernor is an llm_middleware middleware. It prices the usage reported
+by every call that reaches the API and adds it up in multiprocessing shared
+memory, so one governor passed to the workers of a process pool counts the
+calls of all of them. Batch API results are charged by the BatchRunner instead.
+
+Before dispatching a row, an engine asks whether the run can afford it. The
+cost and duration of a row are projected from the average of the rows finished
+so far, and a row is only dispatched if the rows already in flight plus this
+one would still end within max_cost and max_hours. Rows that are not
+dispatched are left unrecorded, so --resume picks them up later.
+"""
+
+import multiprocessing
+import time
+
+
+class BudgetGovernor:
+    def __init__(self, prices, max_cost=None, max_hours=None):
+        # Maps the model name of a request to its OPENAI_PRICING entry.
+        self.prices = prices
+        self.max_cost = max_cost
+        self.max_seconds = max_hours * 3600 if max_hours else None
+        self.started = time.time()
+        self._lock = multiprocessing.Lock()
+        self._cost = multiprocessing.RawValue("d", 0.0)
+        self._calls = multiprocessing.RawValue("q", 0)
+        self._prompt_tokens = multiprocessing.RawValue("q", 0)
+        self._completion_tokens = multiprocessing.RawValue("q", 0)
+        self._rows_finished = multiprocessing.RawValue("q", 0)
+        self._stopped = multiprocessing.RawValue("b", 0)
+
+    @property
+    def cost(self):
+        return self._cost.value
+
+    @property
+    def rows_finished(self):
+        return self._rows_finished.value
+
+    @property
+    def stopped(self):
+        return bool(self._stopped.value)
+
+    def charge(self, model, usage):
+        """Adds the cost of a response's usage."""
+        if usage is None:
+            return
+        price = self.prices.get(model)
+        cost = 0.0
+        if price is not None:
+            cost = (
+                usage.prompt_tokens * price["input"]
+                + usage.completion_tokens * price["output"]
+            )
+        with self._lock:
+            self._cost.value += cost
+            self._calls.value += 1
+            self._prompt_tokens.value += usage.prompt_tokens
+            self._completion_tokens.value += usage.completion_tokens
+
+    def middleware(self, create):
+        def charged_create(**request):
+            response = create(**request)
+            self.charge(request.get("model"), getattr(response, "usage", None))
+            return response
+
+        return charged_create
+
+    def finish_row(self):
+        with self._lock:
+            self._rows_finished.value += 1
+
+    def projection(self, rows):
+        """Projects the total cost and seconds of the run after rows more rows.
+
+        Returns None until a row has finished.
+        """
+        elapsed = time.time() - self.started
+        finished = self.rows_finished
+        if not finished:
+            return None
+        return (
+            self.cost + rows * self.cost / finished,
+            elapsed + rows * elapsed / finished,
+        )
+
+    def allows(self, in_flight):
+        """Whether a row can be dispatched while in_flight rows are unfinished.
+
+        Once it returns False, it keeps doing so.
+        """
+        if self.stopped:
+            return False
+        elapsed = time.time() - self.started
+        cost, seconds = self.projection(in_flight + 1) or (self.cost, elapsed)
+        if (self.max_cost is not None and cost > self.max_cost) or (
+            self.max_seconds is not None and seconds > self.max_seconds
+        ):
+            self._stopped.value = 1
+        return not self.stopped
+
+    def summary(self, remaining_rows=0):
+        """Returns the spend so far and the projection for remaining_rows more rows."""
+        projection = self.projection(remaining_rows)
+        return {
+            "calls": self._calls.value,
+            "prompt_tokens": self._prompt_tokens.value,
+            "completion_tokens": self._completion_tokens.value,
+            "cost": round(self.cost, 4),
+            "hours": round((time.time() - self.started) / 3600, 4),
+            "rows_finished": self.rows_finished,
+            "stopped": self.stopped,
+            "projected_cost": round(projection[0], 4) if projection else None,
+            "projected_hours": round(projection[1] / 3600, 4) if projection else None,
+        }
@@ -0,0 +1,105 @@
+import json
+import mmap
+import os
+from collections import defaultdict
+
+import numpy as np
+
+
+def is_fresh(derived_path, source_path):
+    return os.path.exists(derived_path) and os.path.getmtime(
+        derived_path
+    ) >= os.path.getmtime(source_path)
+
+
+def save_atomically(path, save, *args, **kwargs):
+    """Writes path with save(file, ...) through a temp file and os.replace.
+
+    Shards and queue workers starting together may build the same cache; the
+    others then see either no file or a complete one, never a partial write.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        save(f, *args, **kwargs)
+    os.replace(tmp_path, path)
+
+
+def build_chunk_index(chunks_file, ids_path, offsets_path):
+    """Records the byte offset and length of every line of the chunks file."""
+    doc_ids = []
+    offsets = []
+    with open(chunks_file, "rb") as f:
+        offset = 0
+        for line in f:
+            doc_ids.append(json.loads(line)["_id"])
+            offsets.append((offset, len(line)))
+            offset += len(line)
+    doc_ids = np.array(doc_ids)
+    order = np.argsort(doc_ids, kind="stable")
+    save_atomically(ids_path, np.save, doc_ids[order])
+    save_atomically(offsets_path, np.save, np.array(offsets, dtype=np.int64)[order])
+
+
+class ChunkStore:
+    """Read-only view of a chunks jsonl file that loads chunks on demand.
+
+    A sorted doc_id array and a matching (offset, length) array are built
+    once next to the chunks file and memory-mapped together with the corpus, so
+    only the chunks that are actually looked up are ever parsed.
+    """
+
+    def __init__(self, chunks_file):
+        base = os.path.splitext(chunks_file)[0]
+        ids_path = f"{base}.ids.npy"
+        offsets_path = f"{base}.offsets.npy"
+        if not (
+            is_fresh(ids_path, chunks_file) and is_fresh(offsets_path, chunks_file)
+        ):
+            print(f"Building the chunk offset index of {chunks_file}")
+            build_chunk_index(chunks_file, ids_path, offsets_path)
+        self.doc_ids = np.load(ids_path, mmap_mode="r")
+        self.offsets = np.load(offsets_path, mmap_mode="r")
+        with open(chunks_file, "rb") as f:
+            self.corpus = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __contains__(self, doc_id):
+        position = np.searchsorted(self.doc_ids, doc_id)
+        return position < len(self.doc_ids) and self.doc_ids[position] == doc_id
+
+    def __getitem__(self, doc_id):
+        position = np.searchsorted(self.doc_ids, doc_id)
+        if position == len(self.doc_ids) or self.doc_ids[position] != doc_id:
+            raise KeyError(doc_id)
+        offset, length = self.offsets[position]
+        return json.loads(self.corpus[offset : offset + length])["text"]
+
+
+def parse_rank_file(retrieved_runfile):
+    qid_to_doc_ids = defaultdict(list)
+    with open(retrieved_runfile, "r") as f:
+        for line in f:
+            parts = line.strip().split()
+            if len(parts) < 6:
+                continue
+            qid, _, doc_id, _, _, _ = parts
+            qid_to_doc_ids[qid].append(doc_id)
+    return qid_to_doc_ids
+
+
+def load_rank_file(retrieved_runfile):
+    """Returns parse_rank_file(retrieved_runfile), cached in a binary .npz file."""
+    cache_path = f"{retrieved_runfile}.npz"
+    if is_fresh(cache_path, retrieved_runfile):
+        cached = np.load(cache_path)
+        qid_to_doc_ids = defaultdict(list)
+        for qid, doc_id in zip(cached["qids"].tolist(), cached["doc_ids"].tolist()):
+            qid_to_doc_ids[qid].append(doc_id)
+        return qid_to_doc_ids
+
+    qid_to_doc_ids = parse_rank_file(retrieved_runfile)
+    qids = [qid for qid, doc_ids in qid_to_doc_ids.items() for _ in doc_ids]
+    doc_ids = [doc_id for doc_ids in qid_to_doc_ids.values() for doc_id in doc_ids]
+    save_atomically(
+        cache_path, np.savez, qids=np.array(qids), doc_ids=np.array(doc_ids)
+    )
+    return qid_to_doc_ids
@@ -0,0 +1,70 @@
+# Truncated chunks shorter than this carry too little context to be worth sending.
+MIN_TRUNCATED_CHUNK_TOKENS = 32
+
+
+def truncate_tokens(encoding, tokens, max_tokens):
+    return encoding.decode(tokens[:max_tokens])
+
+
+def pack_context(
+    encoding,
+    completions,
+    retrieved_chunks,
+    token_budget,
+    max_completion_tokens=0,
+    chunk_truncation="drop",
+):
+    """Fits the completions and rank-ordered retrieved chunks into token_budget.
+
+    Completions are always kept, cut to max_completion_tokens each when that is
+    set. Chunks are then added in rank order while they fit. The first chunk
+    that does not fit is either dropped with all the ones after it
+    (chunk_truncation="drop") or cut to the remaining budget
+    (chunk_truncation="truncate").
+
+    Returns the packed completions dict, the packed (doc_id, text) chunks and
+    the token counts of the row.
+    """
+    token_counts = {}
+    packed_completions = {}
+    for key, text in completions.items():
+        tokens = encoding.encode(text, disallowed_special=())
+        if max_completion_tokens and len(tokens) > max_completion_tokens:
+            text = truncate_tokens(encoding, tokens, max_completion_tokens)
+            tokens = tokens[:max_completion_tokens]
+        packed_completions[key] = text
+        token_counts[f"completion_{key}"] = len(tokens)
+
+    remaining = token_budget - sum(token_counts.values())
+    chunk_tokens = encoding.encode_batch(
+        [text for _, text in retrieved_chunks], disallowed_special=()
+    )
+    packed_chunks = []
+    packed_chunk_tokens = 0
+    truncated = 0
+    for (doc_id, text), tokens in zip(retrieved_chunks, chunk_tokens):
+        if len(tokens) <= remaining:
+            packed_chunks.append((doc_id, text))
+            packed_chunk_tokens += len(tokens)
+            remaining -= len(tokens)
+            continue
+        if chunk_truncation == "truncate" and remaining >= MIN_TRUNCATED_CHUNK_TOKENS:
+            packed_chunks.append((doc_id, truncate_tokens(encoding, tokens, remaining)))
+            packed_chunk_tokens += remaining
+            truncated = 1
+        break
+
+    token_counts.update(
+        {
+            "retrieved_chunks": packed_chunk_tokens,
+            "retrieved_chunks_before_packing": sum(len(t) for t in chunk_tokens),
+            "chunks_kept": len(packed_chunks),
+            "chunks_truncated": truncated,
+            "chunks_dropped": len(retrieved_chunks) - len(packed_chunks),
+        }
+    )
+    token_counts["total"] = (
+        sum(token_counts[f"completion_{key}"] for key in completions)
+        + packed_chunk_tokens
+    )
+    return packed_completions, packed_chunks, token_counts
@@ -0,0 +1,42 @@
+import argparse
+import json
+import os
+from multiprocessing import Pool
+
+from tqdm import tqdm
+
+from src.near_duplicates import signatures_path, simhash
+
+
+def signature_line(line):
+    data = json.loads(line)
+    return f"{data['_id']}\t{simhash(data['text']):016x}\n"
+
+
+def main(path_prefix, num_workers):
+    chunks_file = os.path.join(path_prefix, "urls_chunked_corpus.jsonl")
+    output_path = signatures_path(chunks_file)
+
+    with open(chunks_file, "r", encoding="utf-8") as f, open(
+        output_path, "w"
+    ) as out, Pool(num_workers) as pool:
+        for signature in tqdm(pool.imap(signature_line, f, chunksize=256)):
+            out.write(signature)
+    print(f"Saved chunk signatures to {output_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compute SimHash signatures of the chunked corpus for near-duplicate removal."
+    )
+    parser.add_argument(
+        "--path_prefix",
+        type=str,
+        required=True,
+        help="Path prefix containing urls_chunked_corpus.jsonl",
+    )
+    parser.add_argument(
+        "--num_workers", type=int, default=8, help="Number of parallel workers"
+    )
+    args = parser.parse_args()
+    main(args.path_prefix, args.num_workers)
@@ -8,31 +8,25 @@ from urllib.parse import urlparse
 
 import requests
 import urllib3
-from datasets import load_dataset
 from tqdm import tqdm
 
+from src.dataset_snapshot import load_arena_df
+
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 from playwright.sync_api import sync_playwright
 
 
 def aggregate_urls(output_path):
     urls = set()
-    data = load_dataset("lmarena-ai/search-arena-v1-7k", split="test")
-    data_df = data.to_pandas()
+    data_df = load_arena_df(["question_id", "turn", "search_urls"])
     qids_with_urls = set()
     for index, row in tqdm(data_df.iterrows(), total=data_df.shape[0]):
         assert index == row["question_id"]
         if row["turn"] != 1:
             continue
-        for key in ["a", "b"]:
-            web_search_traces = row[f"system_{key}_metadata"]["web_search_trace"]
-            for web_search_trace in web_search_traces:
-                search_results = web_search_trace["search_results"]
-                if search_results is None:
-                    continue
-                for result in search_results:
-                    urls.add(result["url"])
-                    qids_with_urls.add(row["question_id"])
+        if len(row["search_urls"]):
+            urls.update(row["search_urls"])
+            qids_with_urls.add(row["question_id"])
     print(len(qids_with_urls))
     print(len(urls))
 
@@ -0,0 +1,139 @@
+"""Columnar snapshot of lmarena-ai/search-arena-v1-7k shared by all scripts.
+
+Decoding the nested messages and metadata of the HuggingFace dataset dominates
+the start-up time of every script, although each of them only needs a few flat
+fields. `python -m src.dataset_snapshot` writes those fields once to an
+uncompressed Arrow IPC file, sorted by question_id. `load_arena_df` memory-maps
+that file when it exists and otherwise derives the same columns from the
+HuggingFace dataset, so scripts behave the same either way.
+"""
+
+import argparse
+import os
+
+import numpy as np
+import pyarrow as pa
+
+DATASET_NAME = "lmarena-ai/search-arena-v1-7k"
+SNAPSHOT_PATH = os.environ.get(
+    "SEARCH_ARENA_SNAPSHOT",
+    os.path.expanduser("~/.cache/lmsys_nuggetize/search-arena-v1-7k.arrow"),
+)
+
+SNAPSHOT_SCHEMA = pa.schema(
+    [
+        ("question_id", pa.int64()),
+        ("turn", pa.int64()),
+        ("language", pa.string()),
+        ("winner", pa.string()),
+        ("prompt", pa.string()),
+        ("completion_a", pa.string()),
+        ("completion_b", pa.string()),
+        ("search_urls", pa.list_(pa.string())),
+    ]
+)
+
+
+def first_message(messages, index, role):
+    message = messages[index]
+    assert message["role"] == role
+    return message["content"]
+
+
+def search_urls(row):
+    """Returns the URLs of the search results shown to both models, in order."""
+    urls = []
+    for key in ["a", "b"]:
+        for web_search_trace in row[f"system_{key}_metadata"]["web_search_trace"]:
+            for result in web_search_trace["search_results"] or []:
+                urls.append(result["url"])
+    return urls
+
+
+def build_snapshot_table():
+    """Flattens the HuggingFace dataset into a table with SNAPSHOT_SCHEMA."""
+    from datasets import load_dataset
+
+    columns = {name: [] for name in SNAPSHOT_SCHEMA.names}
+    for row in load_dataset(DATASET_NAME, split="test"):
+        prompt = first_message(row["messages_a"], 0, "user")
+        assert prompt == first_message(
+            row["messages_b"], 0, "user"
+        ), "both LLMs should get the same prompt"
+        columns["question_id"].append(row["question_id"])
+        columns["turn"].append(row["turn"])
+        columns["language"].append(row["language"])
+        columns["winner"].append(row["winner"])
+        columns["prompt"].append(prompt)
+        for key in ["a", "b"]:
+            columns[f"completion_{key}"].append(
+                first_message(row[f"messages_{key}"], 1, "assistant")
+            )
+        columns["search_urls"].append(search_urls(row))
+    table = pa.table(columns, schema=SNAPSHOT_SCHEMA)
+    return table.take(np.argsort(columns["question_id"], kind="stable"))
+
+
+def write_snapshot(path=SNAPSHOT_PATH):
+    table = build_snapshot_table()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with pa.OSFile(tmp_path, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+    return table.num_rows
+
+
+class ArenaSnapshot:
+    """Memory-mapped snapshot file; columns are only read when converted.
+
+    Opening it costs next to nothing, and the pages are shared by every process
+    that maps the same file, so worker processes can open their own instance
+    instead of receiving rows from the parent.
+    """
+
+    def __init__(self, path=SNAPSHOT_PATH):
+        self.path = path
+        source = pa.memory_map(path, "r")
+        self.table = pa.ipc.open_file(source).read_all()
+
+    def __len__(self):
+        return self.table.num_rows
+
+    def to_pandas(self, columns=None):
+        table = self.table.select(columns) if columns else self.table
+        return table.to_pandas()
+
+
+def load_arena_df(columns=None, path=SNAPSHOT_PATH):
+    """Returns the flattened dataset as a DataFrame, one row per battle.
+
+    Rows are ordered by question_id, which is also the position of each row,
+    as in the HuggingFace dataset. Only the given SNAPSHOT_SCHEMA columns are
+    materialized; without a snapshot at path they are computed on the fly.
+    """
+    if os.path.exists(path):
+        return ArenaSnapshot(path).to_pandas(columns)
+    print(f"No dataset snapshot at {path}, loading {DATASET_NAME} instead.")
+    table = build_snapshot_table()
+    return (table.select(columns) if columns else table).to_pandas()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=f"Write a memory-mappable snapshot of {DATASET_NAME}."
+    )
+    parser.add_argument(
+        "--output_path",
+        type=str,
+        default=SNAPSHOT_PATH,
+        help="Snapshot file, read back from $SEARCH_ARENA_SNAPSHOT by all scripts.",
+    )
+    args = parser.parse_args()
+    num_rows = write_snapshot(args.output_path)
+    print(f"Wrote {num_rows} battles to {args.output_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""Spreads LLM calls over several Azure OpenAI deployments of the same models.
+
+A pool is configured with a JSON list of deployments, for example:
+
+    [
+      {
+        "endpoint": "https://eastus.openai.azure.com",
+        "api_key_env": "AZURE_OPENAI_API_KEY_EASTUS",
+        "api_version": "2024-12-01-preview",
+        "weight": 450000,
+        "deployments": {"gpt-4.1": "gpt-4.1-eastus"}
+      },
+      ...
+    ]
+
+`api_key` may be given instead of `api_key_env`. `weight` is the deployment's
+share of the traffic, typically its tokens-per-minute quota. `deployments` maps
+model names to deployment names and defaults to using the model name.
+
+Each call goes to the deployment with the fewest outstanding calls relative to
+its weight. A deployment that fails with a rate-limit, timeout, connection or
+server error is taken out of rotation for its retry-after hint or an
+exponentially growing cooldown, and the call is retried on another one.
+
+With a src.rate_limiter.RateLimiter, each deployment is paced to the limiter's
+quotas in a bucket of its own, after it has been picked for a call.
+"""
+
+import json
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+import openai
+from openai import AzureOpenAI
+
+from src.adaptive_concurrency import retry_after_seconds
+
+FAILOVER_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+BASE_COOLDOWN_SECONDS = 5.0
+MAX_COOLDOWN_SECONDS = 300.0
+
+
+class Deployment:
+    def __init__(self, config, http_client=None):
+        self.endpoint = config["endpoint"]
+        self.weight = float(config.get("weight", 1.0))
+        self.deployments = config.get("deployments", {})
+        api_key = config.get("api_key") or os.getenv(config.get("api_key_env", ""))
+        self.client = AzureOpenAI(
+            azure_endpoint=self.endpoint,
+            api_key=api_key,
+            api_version=config.get(
+                "api_version", os.getenv("AZURE_OPENAI_API_VERSION")
+            ),
+            http_client=http_client,
+            # The pool fails over to another deployment instead.
+            max_retries=0,
+        )
+        self.outstanding = 0
+        self.errors = 0
+        self.cooldown_until = 0.0
+
+    def deployment_name(self, model):
+        return self.deployments.get(model, model)
+
+    def bucket(self, model):
+        """Names the rate-limit bucket of the model's deployment."""
+        return f"{urlparse(self.endpoint).hostname}_{self.deployment_name(model)}"
+
+
+class DeploymentPool:
+    """Routes chat completions over deployments by weighted least outstanding load."""
+
+    def __init__(self, configs, http_client=None, rate_limiter=None):
+        if not configs:
+            raise ValueError("A deployment pool needs at least one deployment.")
+        self.deployments = [Deployment(config, http_client) for config in configs]
+        self.rate_limiter = rate_limiter
+        self._condition = threading.Condition()
+
+    def _acquire(self):
+        with self._condition:
+            while True:
+                now = time.time()
+                available = [d for d in self.deployments if d.cooldown_until <= now]
+                if available:
+                    deployment = min(
+                        available, key=lambda d: (d.outstanding + 1) / d.weight
+                    )
+                    deployment.outstanding += 1
+                    return deployment
+                self._condition.wait(
+                    min(d.cooldown_until for d in self.deployments) - now
+                )
+
+    def _release(self, deployment, error=None):
+        with self._condition:
+            deployment.outstanding -= 1
+            if error is None:
+                deployment.errors = 0
+            else:
+                deployment.errors += 1
+                cooldown = retry_after_seconds(error)
+                if cooldown is None:
+                    cooldown = min(
+                        MAX_COOLDOWN_SECONDS,
+                        BASE_COOLDOWN_SECONDS * 2 ** (deployment.errors - 1),
+                    )
+                deployment.cooldown_until = max(
+                    deployment.cooldown_until, time.time() + cooldown
+                )
+            self._condition.notify_all()
+
+    def create(self, *args, **kwargs):
+        for attempt in range(len(self.deployments)):
+            deployment = self._acquire()
+            request = {
+                **kwargs,
+                "model": deployment.deployment_name(kwargs.get("model")),
+            }
+            try:
+                if self.rate_limiter:
+                    response = self.rate_limiter.call(
+                        deployment.bucket(kwargs.get("model")),
+                        deployment.client.chat.completions.create,
+                        *args,
+                        **request,
+                    )
+                else:
+                    response = deployment.client.chat.completions.create(
+                        *args, **request
+                    )
+            except FAILOVER_ERRORS as e:
+                self._release(deployment, e)
+                print(
+                    f"Deployment {deployment.endpoint} failed with {type(e).__name__}, "
+                    f"out of rotation for a while."
+                )
+                if attempt == len(self.deployments) - 1:
+                    raise
+                continue
+            except BaseException:
+                self._release(deployment)
+                raise
+            self._release(deployment)
+            return response
+
+    def middleware(self, create):
+        # The wrapped client's own deployment is replaced by the pool's.
+        return self.create
+
+
+def load_deployment_pool(config_path, http_client=None, rate_limiter=None):
+    with open(config_path, "r") as f:
+        return DeploymentPool(json.load(f), http_client, rate_limiter)
@@ -0,0 +1,162 @@
+"""Per-call deadlines and hedged requests for LLM calls.
+
+A Hedger is an llm_middleware middleware. It gives every call a deadline,
+passed to the openai client as the request timeout. When hedging is enabled,
+it also tracks the latencies of the calls of this process. A call that is still
+running after the hedge_percentile latency gets a duplicate request, and
+whichever answer arrives first is returned. The hedges are capped at
+max_hedge_rate of all calls, so the extra cost stays bounded.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+
+import numpy as np
+
+# Hedging starts once this many latencies have been measured.
+MIN_LATENCY_SAMPLES = 20
+LATENCY_WINDOW = 1000
+SUMMARY_PERCENTILES = [50, 95, 99]
+
+
+def start_call(create, kwargs):
+    """Runs create(**kwargs) in a daemon thread and returns its Future.
+
+    A losing request cannot be cancelled, so it is left to finish on its own
+    thread instead of occupying a slot in a pool.
+    """
+    future = Future()
+
+    def run():
+        try:
+            future.set_result(create(**kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, daemon=True).start()
+    return future
+
+
+def latency_percentiles(latencies):
+    if not latencies:
+        return {}
+    values = np.percentile(np.asarray(latencies), SUMMARY_PERCENTILES)
+    return {f"p{p}": round(float(v), 3) for p, v in zip(SUMMARY_PERCENTILES, values)}
+
+
+class Hedger:
+    def __init__(self, timeout=None, hedge_percentile=None, max_hedge_rate=0.05):
+        self.timeout = timeout
+        self.hedge_percentile = hedge_percentile
+        self.max_hedge_rate = max_hedge_rate
+        self._window = deque(maxlen=LATENCY_WINDOW)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.wasted_tokens = 0
+        # Latency of each returned answer, and of the first request of each call,
+        # which is what the call would have taken without hedging.
+        self.latencies = []
+        self.unhedged_latencies = []
+
+    def _hedge_delay(self):
+        with self._lock:
+            if self.hedge_percentile is None:
+                return None
+            if len(self._window) < MIN_LATENCY_SAMPLES:
+                return None
+            if self.hedges + 1 > self.max_hedge_rate * self.calls:
+                return None
+            return float(np.percentile(self._window, self.hedge_percentile))
+
+    def _record_primary(self, started, future):
+        latency = time.time() - started
+        with self._lock:
+            self.unhedged_latencies.append(latency)
+            if future.exception() is None:
+                self._window.append(latency)
+
+    def _record_loser(self, future):
+        if future.exception() is None:
+            usage = getattr(future.result(), "usage", None)
+            with self._lock:
+                self.wasted_tokens += usage.total_tokens if usage else 0
+
+    def middleware(self, create):
+        def hedged_create(**kwargs):
+            if self.timeout is not None:
+                # Overrides the fixed 30s timeout of nuggetizer's LLMHandler.
+                kwargs["timeout"] = self.timeout
+            with self._lock:
+                self.calls += 1
+            started = time.time()
+            primary = start_call(create, kwargs)
+            primary.add_done_callback(
+                lambda future: self._record_primary(started, future)
+            )
+            delay = self._hedge_delay()
+            if delay is None or wait([primary], timeout=delay).done:
+                response = primary.result()
+                with self._lock:
+                    self.latencies.append(time.time() - started)
+                return response
+
+            with self._lock:
+                self.hedges += 1
+            hedge = start_call(create, kwargs)
+            pending = {primary, hedge}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is None:
+                        with self._lock:
+                            self.latencies.append(time.time() - started)
+                            if future is hedge:
+                                self.hedge_wins += 1
+                        for loser in pending:
+                            loser.add_done_callback(self._record_loser)
+                        return future.result()
+            # Both requests failed.
+            return primary.result()
+
+        return hedged_create
+
+    def stats(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+                "wasted_tokens": self.wasted_tokens,
+                "latencies": list(self.latencies),
+                "unhedged_latencies": list(self.unhedged_latencies),
+            }
+
+    def dump(self, directory):
+        """Writes this process's stats to directory, for summarize_hedging."""
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{os.uname().nodename}_{os.getpid()}.json")
+        with open(path, "w") as f:
+            json.dump(self.stats(), f)
+
+
+def summarize_hedging(directory):
+    """Combines the stats dumped by all processes of a run."""
+    totals = {"calls": 0, "hedges": 0, "hedge_wins": 0, "wasted_tokens": 0}
+    latencies, unhedged_latencies = [], []
+    for name in sorted(os.listdir(directory)) if os.path.isdir(directory) else []:
+        with open(os.path.join(directory, name), "r") as f:
+            stats = json.load(f)
+        for key in totals:
+            totals[key] += stats[key]
+        latencies.extend(stats["latencies"])
+        unhedged_latencies.extend(stats["unhedged_latencies"])
+    totals["hedge_rate"] = totals["hedges"] / max(1, totals["calls"])
+    totals["latency"] = latency_percentiles(latencies)
+    totals["latency_without_hedging"] = latency_percentiles(unhedged_latencies)
+    return totals
@@ -0,0 +1,102 @@
+"""Assigns the nuggets of a battle to both of its completions in one call.
+
+Nuggetizer.assign labels one passage at a time, so every battle sends the query
+and the nugget list twice. The prompt below follows Nuggetizer's assignment
+prompt but shows both passages and asks for both label lists at once, which
+halves the assignment calls. Windows whose answer cannot be parsed into two
+complete label lists fall back to two regular Nuggetizer.assign calls.
+"""
+
+import ast
+
+from nuggetizer.core.types import AssignedScoredNugget, NuggetAssignMode
+
+LABELS = {
+    NuggetAssignMode.SUPPORT_GRADE_2: ["support", "not_support"],
+    NuggetAssignMode.SUPPORT_GRADE_3: ["support", "partial_support", "not_support"],
+}
+
+
+def joint_assign_prompt(nuggetizer, query, completions, nuggets):
+    nugget_texts = [nugget.text for nugget in nuggets]
+    if nuggetizer.assigner_mode == NuggetAssignMode.SUPPORT_GRADE_2:
+        criteria = "either as support or not_support using the following criteria. A nugget that is fully captured in the passage should be labeled as support; otherwise, label them as not_support."
+    else:
+        criteria = "either as support, partial_support, or not_support using the following criteria. A nugget that is fully captured in the passage should be labeled as support. A nugget that is partially captured in the passage should be labeled as partial_support. If the nugget is not captured at all, label it as not_support."
+    return [
+        {
+            "role": "system",
+            "content": "You are NuggetizeAssignerLLM, an intelligent assistant that can label a list of atomic nuggets based on if they are captured by a given passage.",
+        },
+        {
+            "role": "user",
+            "content": f"""Based on the query and each of the two passages, label each of the {len(nuggets)} nuggets {criteria} Label the nuggets for Passage A and Passage B independently. Return a Pythonic dictionary with the keys "A" and "B", each mapping to the list of labels (type: List[str]) for that passage. Each list should be in the same order as the input nuggets. Make sure to provide a label for each nugget in both lists.
+
+Search Query: {query}
+Passage A: {completions["a"]}
+Passage B: {completions["b"]}
+Nugget List: {nugget_texts}
+Only return the dictionary of label lists (Dict[str, List[str]]). Do not explain.
+Labels:""",
+        },
+    ]
+
+
+def parse_joint_labels(response, num_nuggets, labels):
+    """Returns the label lists of passages a and b, or None if malformed."""
+    response = response.replace("```python", "").replace("```", "").strip()
+    try:
+        parsed = ast.literal_eval(response)
+    except (ValueError, SyntaxError):
+        return None
+    if not isinstance(parsed, dict):
+        return None
+    parsed = {str(key).strip().lower(): value for key, value in parsed.items()}
+    result = {}
+    for key in ["a", "b"]:
+        assignments = parsed.get(key)
+        if not isinstance(assignments, list) or len(assignments) != num_nuggets:
+            return None
+        assignments = [str(label).strip().lower() for label in assignments]
+        if any(label not in labels for label in assignments):
+            return None
+        result[key] = assignments
+    return result
+
+
+def assign_jointly(nuggetizer, query, completions, nuggets):
+    """Assigns nuggets to completions "a" and "b" with one call per window.
+
+    Returns the assigned nuggets per completion, like two Nuggetizer.assign
+    calls would, and the number of windows that fell back to separate calls.
+    """
+    if any(not completions[key].strip() for key in ["a", "b"]):
+        assigned = {
+            key: nuggetizer.assign(query, completions[key], nuggets)
+            for key in ["a", "b"]
+        }
+        return assigned, 0
+
+    labels = LABELS[nuggetizer.assigner_mode]
+    assigned = {"a": [], "b": []}
+    fallbacks = 0
+    window_size = nuggetizer.assigner_window_size
+    for start in range(0, len(nuggets), window_size):
+        window_nuggets = nuggets[start : start + window_size]
+        prompt = joint_assign_prompt(nuggetizer, query, completions, window_nuggets)
+        response, _ = nuggetizer.assigner_llm.run(prompt, temperature=0.0)
+        parsed = parse_joint_labels(response, len(window_nuggets), labels)
+        for key in ["a", "b"]:
+            if parsed is None:
+                assigned[key].extend(
+                    nuggetizer.assign(query, completions[key], window_nuggets)
+                )
+                continue
+            assigned[key].extend(
+                AssignedScoredNugget(
+                    text=nugget.text, importance=nugget.importance, assignment=label
+                )
+                for nugget, label in zip(window_nuggets, parsed[key])
+            )
+        fallbacks += parsed is None
+    return assigned, fallbacks
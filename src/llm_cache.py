@@ -0,0 +1,155 @@
+import functools
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from openai.types.chat import ChatCompletion
+
+from src.llm_middleware import LLMCallAborted
+
+# Request options that do not change the response and are left out of the key.
+IGNORED_REQUEST_KEYS = {"timeout", "extra_headers"}
+
+
+class CacheMissError(LLMCallAborted):
+    pass
+
+
+class LLMCache:
+    """Persistent chat completion cache keyed on a hash of the full request.
+
+    Entries live in a SQLite database that can be shared by threads and worker
+    processes. Once the stored responses exceed max_size_bytes, the least
+    recently used entries are evicted. With replay_only, a miss raises
+    CacheMissError instead of calling the API.
+
+    Nuggetizer retries a request whose answer it could not parse by sending the
+    same request again. A repeat of the request that was just answered on the
+    same thread is therefore keyed as the next attempt, so it is sampled anew
+    instead of being served the rejected response, and a rerun replays the
+    attempts in order.
+    """
+
+    EVICTION_INTERVAL = 100
+
+    def __init__(self, path, max_size_bytes=10 * 1024**3, replay_only=False):
+        self.path = path
+        self.max_size_bytes = max_size_bytes
+        self.replay_only = replay_only
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, model TEXT, response TEXT, "
+                "size INTEGER, last_access REAL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS responses_last_access "
+                "ON responses (last_access)"
+            )
+
+    def _connect(self):
+        # sqlite3 connections must not cross threads or forked processes.
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=60)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @staticmethod
+    def key(request):
+        request = {k: v for k, v in request.items() if k not in IGNORED_REQUEST_KEYS}
+        payload = json.dumps(request, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def attempt_key(self, request):
+        """Returns the key of request's current attempt on this thread.
+
+        The cache middleware sets it before calling through, so inner
+        middlewares such as BatchRunner store responses under the same key.
+        """
+        key = self.key(request)
+        current = getattr(self._local, "attempt", None)
+        if current is not None and current[0] == key and current[1]:
+            return f"{key}-{current[1]}"
+        return key
+
+    def _start_attempt(self, key):
+        answered = getattr(self._local, "answered", None)
+        attempt = answered[1] + 1 if answered and answered[0] == key else 0
+        self._local.attempt = (key, attempt)
+        return attempt
+
+    def get(self, key):
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT response FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE responses SET last_access = ? WHERE key = ?",
+                (time.time(), key),
+            )
+        return row[0]
+
+    def put(self, key, model, response):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (key, model, response, len(response.encode("utf-8")), time.time()),
+            )
+        self._puts += 1
+        if self._puts % self.EVICTION_INTERVAL == 0:
+            self.evict()
+
+    def evict(self):
+        with self._connect() as conn:
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses")
+            excess = total.fetchone()[0] - self.max_size_bytes
+            if excess <= 0:
+                return
+            freed = 0
+            stale_keys = []
+            for key, size in conn.execute(
+                "SELECT key, size FROM responses ORDER BY last_access"
+            ):
+                if freed >= excess:
+                    break
+                stale_keys.append((key,))
+                freed += size
+            conn.executemany("DELETE FROM responses WHERE key = ?", stale_keys)
+
+    def middleware(self, create):
+        @functools.wraps(create)
+        def cached_create(**request):
+            base_key = self.key(request)
+            attempt = self._start_attempt(base_key)
+            key = f"{base_key}-{attempt}" if attempt else base_key
+            cached = self.get(key)
+            if cached is not None:
+                self.hits += 1
+                response = ChatCompletion.model_validate_json(cached)
+            else:
+                self.misses += 1
+                if self.replay_only:
+                    raise CacheMissError(
+                        f"No cached response for {request.get('model')} request {key}"
+                    )
+                # A failed call leaves the attempt to be retried under the same key.
+                self._local.answered = (base_key, attempt - 1)
+                response = create(**request)
+                self.put(key, request.get("model"), response.model_dump_json())
+            self._local.answered = (base_key, attempt)
+            return response
+
+        return cached_create
@@ -0,0 +1,57 @@
+"""Hooks for routing chat completion calls through shared middleware.
+
+A middleware is a function that takes a ``chat.completions.create`` callable and
+returns a callable with the same signature. Both OpenAIClient and the
+Nuggetizer's LLM handlers talk to an openai client, so wrapping the client is
+the one place every LLM call in the repo passes through.
+"""
+
+import httpx
+from openai import DefaultHttpxClient
+
+NUGGETIZER_LLM_HANDLERS = ("creator_llm", "scorer_llm", "assigner_llm")
+
+
+class LLMCallAborted(BaseException):
+    """Stops an LLM call for good instead of letting it be retried.
+
+    Derives from BaseException so that it escapes the catch-all retry loops in
+    nuggetizer's LLMHandler.run, Nuggetizer.create and Nuggetizer.assign.
+    """
+
+
+def wrap_chat_completions(client, *middlewares):
+    """Routes client.chat.completions.create through the given middlewares.
+
+    The first middleware is the outermost one. None entries are ignored.
+    """
+    completions = client.chat.completions
+    create = completions.create
+    for middleware in reversed(middlewares):
+        if middleware is not None:
+            create = middleware(create)
+    completions.create = create
+
+
+def wrap_nuggetizer(nuggetizer, *middlewares):
+    for attribute in NUGGETIZER_LLM_HANDLERS:
+        wrap_chat_completions(getattr(nuggetizer, attribute).client, *middlewares)
+
+
+def build_http_client(pool_size):
+    """Builds a keep-alive connection pool that several openai clients can share."""
+    return DefaultHttpxClient(
+        limits=httpx.Limits(
+            max_connections=pool_size, max_keepalive_connections=pool_size
+        )
+    )
+
+
+def share_http_client(nuggetizer, http_client, max_retries=None):
+    """Points all LLM handlers at http_client, optionally overriding SDK retries."""
+    options = {"http_client": http_client}
+    if max_retries is not None:
+        options["max_retries"] = max_retries
+    for attribute in NUGGETIZER_LLM_HANDLERS:
+        handler = getattr(nuggetizer, attribute)
+        handler.client = handler.client.with_options(**options)
@@ -0,0 +1,193 @@
+"""Append-only trace of LLM calls, and a per-stage summary of it.
+
+A CallTracer is an llm_middleware middleware that appends one JSON line per
+call to its trace file: question_id, stage, model, start and end times, the
+prompt and completion tokens of response.usage, the retry count and the error
+class of a failed call. Installed behind the LLM cache, it only records calls
+that actually reach the API.
+
+The question_id and stage come from the calling thread. Rows set them with
+``with tracer.context(question_id=..., stage=...)``, and tag_nuggetizer names
+the stage of each of a Nuggetizer's handlers. The retry count is the number of
+failed attempts at the same request made just before on the same thread, as by
+the retry loops of Nuggetizer and OpenAIClient.response, or the number of
+failed batch rounds of a batch request. Retries inside the openai SDK and the
+AIMD limiter, and failovers between the deployments of a pool, happen within a
+single traced call; they are not counted, but add to its latency.
+
+Run ``python -m src.llm_trace --trace_path path/to/llm_trace.jsonl`` for latency
+percentiles, tokens per second and error rates per stage.
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from src.hedging import latency_percentiles
+from src.llm_cache import LLMCache
+from src.llm_middleware import LLMCallAborted, wrap_chat_completions
+
+NUGGETIZER_STAGES = {
+    "creator_llm": "create",
+    "scorer_llm": "score",
+    "assigner_llm": "assign",
+}
+
+
+class CallTracer:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def reset(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    @contextmanager
+    def context(self, **fields):
+        previous = getattr(self._local, "fields", {})
+        self._local.fields = {**previous, **fields}
+        try:
+            yield
+        finally:
+            self._local.fields = previous
+
+    def stage_middleware(self, stage):
+        def middleware(create):
+            def staged_create(**request):
+                with self.context(stage=stage):
+                    return create(**request)
+
+            return staged_create
+
+        return middleware
+
+    def tag_nuggetizer(self, nuggetizer):
+        """Names the stage of each handler's calls; call after wrap_nuggetizer."""
+        for attribute, stage in NUGGETIZER_STAGES.items():
+            wrap_chat_completions(
+                getattr(nuggetizer, attribute).client, self.stage_middleware(stage)
+            )
+
+    def write(self, record):
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        # One O_APPEND write per record keeps lines intact across processes.
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+
+    def fields(self):
+        """Returns the question_id and stage of the calling thread."""
+        return {
+            "question_id": None,
+            "stage": None,
+            **getattr(self._local, "fields", {}),
+        }
+
+    def write_call(self, fields, model, start, retries, usage=None, error=None):
+        """Records a call that started at start and ended now."""
+        self.write(
+            {
+                **fields,
+                "model": model,
+                "start": start,
+                "retries": retries,
+                "prompt_tokens": usage.prompt_tokens if usage else None,
+                "completion_tokens": usage.completion_tokens if usage else None,
+                "end": time.time(),
+                "error": error,
+            }
+        )
+
+    def middleware(self, create):
+        def traced_create(**request):
+            key = LLMCache.key(request)
+            failed_key, failures = getattr(self._local, "failure", (None, 0))
+            retries = failures if failed_key == key else 0
+            fields = self.fields()
+            start = time.time()
+            try:
+                response = create(**request)
+            except LLMCallAborted:
+                # Cache misses in replay mode and deferred batch calls.
+                raise
+            except Exception as e:
+                self._local.failure = (key, retries + 1)
+                self.write_call(
+                    fields, request.get("model"), start, retries, error=type(e).__name__
+                )
+                raise
+            self._local.failure = (None, 0)
+            self.write_call(
+                fields,
+                request.get("model"),
+                start,
+                retries,
+                usage=getattr(response, "usage", None),
+            )
+            return response
+
+        return traced_create
+
+
+def read_trace(path):
+    """Yields the records of a trace file, skipping a truncated last line."""
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+
+def summarize_trace(path):
+    """Returns latency percentiles, tokens per second and error rates per stage."""
+    records = defaultdict(list)
+    for record in read_trace(path):
+        records[record["stage"] or "unknown"].append(record)
+    summary = {}
+    for stage, stage_records in sorted(records.items()):
+        succeeded = [r for r in stage_records if r["error"] is None]
+        latencies = [r["end"] - r["start"] for r in succeeded]
+        completion_tokens = sum(r["completion_tokens"] or 0 for r in succeeded)
+        summary[stage] = {
+            "calls": len(stage_records),
+            "errors": len(stage_records) - len(succeeded),
+            "error_rate": 1 - len(succeeded) / len(stage_records),
+            "error_classes": dict(
+                Counter(r["error"] for r in stage_records if r["error"] is not None)
+            ),
+            "retried_calls": sum(r["retries"] > 0 for r in stage_records),
+            "latency": latency_percentiles(latencies),
+            "prompt_tokens": sum(r["prompt_tokens"] or 0 for r in succeeded),
+            "completion_tokens": completion_tokens,
+            # Completion tokens per second of call time, over the stage's calls.
+            "completion_tokens_per_second": (
+                round(completion_tokens / sum(latencies), 2) if latencies else None
+            ),
+        }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Summarize an LLM call trace per stage."
+    )
+    parser.add_argument(
+        "--trace_path",
+        type=str,
+        required=True,
+        help="llm_trace.jsonl written by nuggetize_responses or query_categorization.",
+    )
+    args = parser.parse_args()
+    print(json.dumps(summarize_trace(args.trace_path), indent=2))
+
+
+if __name__ == "__main__":
+    main()
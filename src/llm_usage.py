@@ -0,0 +1,43 @@
+"""Per-row accounting of the token usage reported by LLM calls.
+
+UsageTracker is an llm_middleware middleware. Calls made inside a
+``with tracker.track() as usage:`` block, on the same thread, add their
+reported usage and latency to ``usage``. Installed behind the LLM cache, it
+only counts calls that actually reach the API.
+"""
+
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+
+class UsageTracker:
+    def __init__(self):
+        self._local = threading.local()
+
+    @contextmanager
+    def track(self):
+        usage = Counter()
+        previous = getattr(self._local, "usage", None)
+        self._local.usage = usage
+        try:
+            yield usage
+        finally:
+            self._local.usage = previous
+
+    def middleware(self, create):
+        def tracked_create(**request):
+            started = time.time()
+            response = create(**request)
+            usage = getattr(self._local, "usage", None)
+            if usage is not None and response.usage is not None:
+                details = getattr(response.usage, "prompt_tokens_details", None)
+                usage["calls"] += 1
+                usage["prompt_tokens"] += response.usage.prompt_tokens
+                usage["cached_tokens"] += getattr(details, "cached_tokens", 0) or 0
+                usage["completion_tokens"] += response.usage.completion_tokens
+                usage["latency_seconds"] += time.time() - started
+            return response
+
+        return tracked_create
@@ -0,0 +1,107 @@
+import argparse
+import json
+import os
+import shutil
+from collections import Counter, defaultdict
+
+from tqdm import tqdm
+
+from src.dataset_snapshot import load_arena_df
+from src.planner import shard_ids, shard_path_prefix
+
+
+def read_shard(shard_prefix):
+    with open(os.path.join(shard_prefix, "results.jsonl"), "r") as f:
+        results = [json.loads(l) for l in f]
+    with open(os.path.join(shard_prefix, "skips.json"), "r") as f:
+        skips = json.load(f)
+    return results, skips
+
+
+def validate_coverage(question_ids, shard_qids, num_shards):
+    """Checks that every question is reported exactly once, by its own shard."""
+    expected_shards = dict(zip(question_ids, shard_ids(question_ids, num_shards)))
+    counts = Counter(qid for qids in shard_qids.values() for qid in qids)
+    missing = sorted(set(question_ids) - set(counts))
+    duplicated = sorted(qid for qid, count in counts.items() if count > 1)
+    unknown = sorted(set(counts) - set(question_ids))
+    misplaced = sorted(
+        qid
+        for shard_id, qids in shard_qids.items()
+        for qid in qids
+        if qid in expected_shards and expected_shards[qid] != shard_id
+    )
+    problems = {
+        "missing": missing,
+        "duplicated": duplicated,
+        "unknown": unknown,
+        "misplaced": misplaced,
+    }
+    if any(problems.values()):
+        summary = {name: qids[:20] for name, qids in problems.items() if qids}
+        raise ValueError(
+            f"Shard outputs do not cover the planned questions exactly once: {summary}"
+        )
+
+
+def main(path_prefix, num_shards, output_path):
+    data_df = load_arena_df(["question_id"])
+    question_ids = data_df["question_id"].to_numpy()
+
+    results = []
+    skips = defaultdict(list)
+    shard_qids = {}
+    for shard_id in range(num_shards):
+        shard_results, shard_skips = read_shard(
+            shard_path_prefix(path_prefix, shard_id, num_shards)
+        )
+        results.extend(shard_results)
+        for reason, qids in shard_skips.items():
+            skips[reason].extend(qids)
+        shard_qids[shard_id] = [r["question_id"] for r in shard_results] + [
+            qid for qids in shard_skips.values() for qid in qids
+        ]
+    validate_coverage(question_ids.tolist(), shard_qids, num_shards)
+
+    for subdir in ["nuggets", "assignments"]:
+        os.makedirs(os.path.join(output_path, subdir), exist_ok=True)
+        for shard_id in range(num_shards):
+            shard_dir = os.path.join(
+                shard_path_prefix(path_prefix, shard_id, num_shards), subdir
+            )
+            for filename in tqdm(os.listdir(shard_dir), desc=f"{subdir} {shard_id}"):
+                shutil.copy2(
+                    os.path.join(shard_dir, filename),
+                    os.path.join(output_path, subdir, filename),
+                )
+
+    with open(os.path.join(output_path, "results.jsonl"), "w") as f:
+        for result in results:
+            json.dump(result, f)
+            f.write("\n")
+
+    with open(os.path.join(output_path, "skips.json"), "w") as f:
+        json.dump(skips, f)
+        f.write("\n")
+    print(f"Merged {len(results)} results from {num_shards} shards into {output_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Merge the outputs of a sharded nuggetize_responses run."
+    )
+    parser.add_argument(
+        "--path_prefix",
+        type=str,
+        required=True,
+        help="The --path_prefix passed to every shard of the run",
+    )
+    parser.add_argument("--num_shards", type=int, required=True)
+    parser.add_argument(
+        "--output_path",
+        type=str,
+        default=None,
+        help="Directory for the merged outputs, defaults to path_prefix",
+    )
+    args = parser.parse_args()
+    main(args.path_prefix, args.num_shards, args.output_path or args.path_prefix)
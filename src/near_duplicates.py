@@ -0,0 +1,69 @@
+import hashlib
+import os
+import re
+
+import numpy as np
+
+# CJK characters count as tokens of their own, everything else splits on words.
+TOKEN_PATTERN = re.compile(
+    r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]|\w+"
+)
+SHINGLE_SIZE = 3
+BIT_POSITIONS = np.arange(64, dtype=np.uint64)
+
+
+def signatures_path(chunks_file):
+    return f"{os.path.splitext(chunks_file)[0]}.simhash.tsv"
+
+
+def simhash(text):
+    """Returns the 64-bit SimHash of the word 3-shingles of text."""
+    tokens = TOKEN_PATTERN.findall(text.lower())
+    if not tokens:
+        return 0
+    shingles = [
+        " ".join(tokens[i : i + SHINGLE_SIZE])
+        for i in range(max(1, len(tokens) - SHINGLE_SIZE + 1))
+    ]
+    hashes = np.fromiter(
+        (
+            int.from_bytes(
+                hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little"
+            )
+            for s in shingles
+        ),
+        dtype=np.uint64,
+        count=len(shingles),
+    )
+    votes = ((hashes[:, None] >> BIT_POSITIONS) & np.uint64(1)).sum(axis=0)
+    return sum(1 << int(bit) for bit in np.flatnonzero(2 * votes > len(shingles)))
+
+
+def load_signatures(path, doc_ids):
+    """Reads the signatures of the given doc ids from a doc_id<TAB>hex file."""
+    signatures = {}
+    with open(path, "r") as f:
+        for line in f:
+            doc_id, signature = line.rstrip("\n").split("\t")
+            if doc_id in doc_ids:
+                signatures[doc_id] = int(signature, 16)
+    return signatures
+
+
+def drop_near_duplicates(doc_ids, signatures, max_distance):
+    """Keeps doc ids in rank order, dropping any within max_distance bits of a kept one.
+
+    Returns the kept and the removed doc ids.
+    """
+    kept, removed, kept_signatures = [], [], []
+    for doc_id in doc_ids:
+        signature = signatures.get(doc_id)
+        if signature is not None and any(
+            (signature ^ other).bit_count() <= max_distance for other in kept_signatures
+        ):
+            removed.append(doc_id)
+            continue
+        kept.append(doc_id)
+        if signature is not None:
+            kept_signatures.append(signature)
+    return kept, removed
@@ -0,0 +1,50 @@
+"""Merges near-paraphrase nuggets before they are assigned.
+
+Nuggets are short, so they are compared by the Jaccard similarity of their
+word sets, using the same CJK-aware tokenization as chunk deduplication.
+"""
+
+from nuggetizer.core.types import ScoredNugget
+
+from src.near_duplicates import TOKEN_PATTERN
+
+IMPORTANCE_RANK = {"vital": 0, "okay": 1}
+
+
+def nugget_tokens(text):
+    return frozenset(TOKEN_PATTERN.findall(text.lower()))
+
+
+def jaccard(first, second):
+    if not first or not second:
+        return 0.0
+    return len(first & second) / len(first | second)
+
+
+def compact_nuggets(scored_nuggets, threshold, max_nuggets=None):
+    """Merges nuggets with a word-set Jaccard similarity of at least threshold.
+
+    The first nugget of each group is kept, with the highest importance of the
+    group. The result is ordered vital first, as Nuggetizer.create orders it,
+    and capped at max_nuggets.
+    """
+    kept, kept_tokens = [], []
+    for nugget in scored_nuggets:
+        tokens = nugget_tokens(nugget.text)
+        match = next(
+            (
+                i
+                for i, other in enumerate(kept_tokens)
+                if jaccard(tokens, other) >= threshold
+            ),
+            None,
+        )
+        if match is None:
+            kept.append(ScoredNugget(text=nugget.text, importance=nugget.importance))
+            kept_tokens.append(tokens)
+        elif IMPORTANCE_RANK.get(nugget.importance, 2) < IMPORTANCE_RANK.get(
+            kept[match].importance, 2
+        ):
+            kept[match].importance = nugget.importance
+    kept = sorted(kept, key=lambda n: IMPORTANCE_RANK.get(n.importance, 2))
+    return kept[:max_nuggets] if max_nuggets else kept
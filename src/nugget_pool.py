@@ -0,0 +1,64 @@
+"""Shares one nugget pool between battles with the same prompt.
+
+Battles are grouped by their normalized prompt. The first battle of a group to
+reach nugget creation creates the group's pool from the retrieved chunks and
+the completions of all its battles, under an exclusive file lock, and saves it.
+The other battles of the group wait for the lock and reuse the saved pool, so
+every process and thread of a run creates each pool once.
+"""
+
+import fcntl
+import json
+import os
+from contextlib import contextmanager
+
+
+def normalize_prompt(text):
+    return " ".join(text.lower().split())
+
+
+def group_by_prompt(prompts):
+    """Maps each key of prompts to the list of keys with the same normalized prompt.
+
+    prompts is a dict or Series of prompt texts; the groups keep its order.
+    """
+    groups = {}
+    for key, prompt in prompts.items():
+        groups.setdefault(normalize_prompt(prompt), []).append(int(key))
+    return {key: group for group in groups.values() for key in group}
+
+
+def pool_path(directory, group):
+    return os.path.join(directory, f"pool_{group[0]}.json")
+
+
+@contextmanager
+def file_lock(path):
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+
+def load_or_create_pool(path, group, create):
+    """Returns the pool of group saved at path and whether this call created it.
+
+    create() builds the pool as a JSON-serializable dict with the group's
+    question_ids. It runs under the pool's lock, so it is called at most once
+    per path unless it raises. A saved pool of a different group is replaced.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with file_lock(f"{path}.lock"):
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                pool = json.load(f)
+            if pool["question_ids"] == list(group):
+                return pool, False
+        pool = create()
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(pool, f, ensure_ascii=False)
+        os.replace(temp_path, path)
+    return pool, True
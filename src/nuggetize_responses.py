@@ -1,18 +1,49 @@
 import argparse
+import asyncio
 import dataclasses
 import json
+import multiprocessing.util
 import os
-import random
-from collections import defaultdict
-from concurrent.futures import ProcessPoolExecutor, as_completed
+import shutil
+import socket
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 
-from datasets import load_dataset
+import tiktoken
 from nuggetizer.core.metrics import calculate_nugget_scores
-from nuggetizer.core.types import Document, Query, Request
+from nuggetizer.core.types import Document, Query, Request, ScoredNugget
 from nuggetizer.models.nuggetizer import Nuggetizer
 from tqdm import tqdm
 
-from src.utils import get_prompt
+from src.adaptive_concurrency import AIMDLimiter
+from src.analysis.openai_client import OPENAI_PRICING, TOKENIZER_OPENAI
+from src.assignment_cascade import cascade_assign, summarize_cascade
+from src.batch_api import BatchDeferred, BatchItemFailed, build_batch_runner
+from src.budget import BudgetGovernor
+from src.chunk_store import ChunkStore, load_rank_file
+from src.context_packing import pack_context
+from src.dataset_snapshot import load_arena_df
+from src.deployment_pool import load_deployment_pool
+from src.hedging import Hedger, summarize_hedging
+from src.joint_assignment import assign_jointly
+from src.llm_cache import LLMCache
+from src.llm_middleware import build_http_client, share_http_client, wrap_nuggetizer
+from src.llm_trace import CallTracer, summarize_trace
+from src.llm_usage import UsageTracker
+from src.near_duplicates import drop_near_duplicates, load_signatures, signatures_path
+from src.nugget_compaction import compact_nuggets
+from src.nugget_pool import group_by_prompt, load_or_create_pool, pool_path
+from src.planner import (
+    estimate_run_cost,
+    hash_unit_interval,
+    plan_rows,
+    shard_path_prefix,
+)
+from src.rate_limiter import RateLimiter
+from src.result_sink import ResultSink
+from src.run_manifest import ASSIGNED, CREATED, FAILED, SKIPPED, RunManifest
+from src.work_queue import WorkQueue
 
 # Arguments
 parser = argparse.ArgumentParser()
@@ -22,21 +53,176 @@ parser.add_argument(
     default=0.005,
     help="Sampling rate for processing rows",
 )
+parser.add_argument(
+    "--seed",
+    type=int,
+    default=42,
+    help="Seed of the question_id hash that decides sampling and a/b order",
+)
+parser.add_argument(
+    "--dry_run",
+    action="store_true",
+    help="Only report the planned rows with their estimated prompt tokens and cost",
+)
 parser.add_argument(
     "--path_prefix",
     type=str,
     default="/mnt/users/s8sharif/search_arena/with_response",
     help="Output path prefix",
 )
+parser.add_argument(
+    "--shard_id",
+    type=int,
+    default=0,
+    help="Index of the shard of question_ids processed by this run",
+)
+parser.add_argument(
+    "--num_shards",
+    type=int,
+    default=1,
+    help="Number of shards the run is split into; outputs go to path_prefix/shard_{shard_id}_of_{num_shards}",
+)
 parser.add_argument(
     "--max_workers", type=int, default=4, help="Number of parallel workers"
 )
+parser.add_argument(
+    "--engine",
+    type=str,
+    choices=["process", "async", "queue", "batch"],
+    default="process",
+    help="process: a pool of --max_workers processes; async: a single process with up to --max_in_flight concurrent rows; queue: --max_workers threads pulling jobs from the shared --queue_db; batch: rounds of Batch API jobs.",
+)
+parser.add_argument(
+    "--queue_db",
+    type=str,
+    default="",
+    help="SQLite job table shared by queue workers, defaults to path_prefix/jobs.sqlite",
+)
+parser.add_argument(
+    "--lease_seconds",
+    type=float,
+    default=1800,
+    help="How long a queue worker may hold a row before other workers reclaim it",
+)
+parser.add_argument(
+    "--max_attempts",
+    type=int,
+    default=3,
+    help="Attempts per row in the queue engine, or per request in the batch engine, before it is recorded as skipped",
+)
+parser.add_argument(
+    "--batch_backend",
+    type=str,
+    choices=["openai", "local", "canned"],
+    default="openai",
+    help="openai: submit batch files to the Batch API; local: process them with synchronous calls; canned: answer them offline from --batch_responses_dir.",
+)
+parser.add_argument(
+    "--batch_responses_dir",
+    type=str,
+    default="",
+    help="Directory of recorded *.output.jsonl batch results for --batch_backend canned, e.g. an earlier run's batches/.",
+)
+parser.add_argument(
+    "--batch_poll_seconds",
+    type=float,
+    default=60.0,
+    help="Seconds between status checks of submitted batches",
+)
+parser.add_argument(
+    "--batch_deployment_suffix",
+    type=str,
+    default="",
+    help="Appended to model names in batch files, for batch deployments such as gpt-4o-mini-batch",
+)
+parser.add_argument(
+    "--max_in_flight",
+    type=int,
+    default=None,
+    help="Maximum number of rows processed concurrently by the async engine, split between its two stages (defaults to --http_pool_size)",
+)
+parser.add_argument(
+    "--max_in_flight_create",
+    type=int,
+    default=None,
+    help="Concurrent nugget creation rows in the async engine (defaults to half of --max_in_flight)",
+)
+parser.add_argument(
+    "--max_in_flight_assign",
+    type=int,
+    default=None,
+    help="Concurrent nugget assignment rows in the async engine (defaults to half of --max_in_flight)",
+)
+parser.add_argument(
+    "--stage",
+    type=str,
+    choices=["all", "assign"],
+    default="all",
+    help="all: create and assign nuggets; assign: only rebuild assignments and metrics from existing nuggets/*.json files.",
+)
+parser.add_argument(
+    "--nuggets_path_prefix",
+    type=str,
+    default="",
+    help="With --stage assign, read nuggets/*.json from this path prefix instead of --path_prefix.",
+)
 parser.add_argument(
     "--model_name",
     type=str,
     default="gpt-4.1",
     help="the model name, for now from gpt family only.",
 )
+parser.add_argument(
+    "--shared_nugget_pool",
+    action="store_true",
+    help="Create one nugget pool per group of planned battles with the same normalized prompt, and assign each battle against it.",
+)
+parser.add_argument(
+    "--compact_nuggets",
+    action="store_true",
+    help="Merge near-duplicate nuggets between creation and assignment.",
+)
+parser.add_argument(
+    "--compaction_threshold",
+    type=float,
+    default=0.6,
+    help="Word-set Jaccard similarity at which --compact_nuggets merges two nuggets.",
+)
+parser.add_argument(
+    "--compacted_max_nuggets",
+    type=int,
+    default=None,
+    help="Cap on the number of nuggets kept by --compact_nuggets.",
+)
+parser.add_argument(
+    "--joint_assignment",
+    action="store_true",
+    help="Assign the nuggets to both completions of a battle in one LLM call per window.",
+)
+parser.add_argument(
+    "--cascade_model_name",
+    type=str,
+    default="",
+    help="Cheap model that assigns nuggets first, e.g. gpt-4.1-nano; uncertain nuggets are re-assigned by the assigner model.",
+)
+parser.add_argument(
+    "--cascade_samples",
+    type=int,
+    default=1,
+    help="Samples drawn from the cascade model; nuggets whose samples disagree are escalated.",
+)
+parser.add_argument(
+    "--cascade_holdout_rate",
+    type=float,
+    default=0.05,
+    help="Fraction of rows also fully assigned by the assigner model to measure the cascade's agreement.",
+)
+parser.add_argument(
+    "--assigner_model_name",
+    type=str,
+    default="",
+    help="the model used for nugget assignment, defaults to --model_name.",
+)
 parser.add_argument(
     "--retrieved_runfile",
     type=str,
@@ -58,173 +244,1172 @@ parser.add_argument(
     default=50,
     help="the maximum number or retrieved chunks used for nugget creation",
 )
+parser.add_argument(
+    "--dedup_chunks",
+    action="store_true",
+    help="Drop near-duplicate retrieved chunks per query using the SimHash signatures stored next to --chunks_file.",
+)
+parser.add_argument(
+    "--dedup_max_distance",
+    type=int,
+    default=3,
+    help="Chunks whose 64-bit SimHash signatures differ in at most this many bits are near-duplicates.",
+)
+parser.add_argument(
+    "--token_budget",
+    type=int,
+    default=0,
+    help="Token budget for the completions plus retrieved chunks used in nugget creation, 0 disables packing.",
+)
+parser.add_argument(
+    "--max_completion_tokens",
+    type=int,
+    default=0,
+    help="With --token_budget, cut each completion to this many tokens for nugget creation, 0 keeps them whole.",
+)
+parser.add_argument(
+    "--chunk_truncation",
+    type=str,
+    choices=["drop", "truncate"],
+    default="drop",
+    help="With --token_budget, drop the first chunk that does not fit, or truncate it to the remaining budget.",
+)
+parser.add_argument(
+    "--context_layout",
+    type=str,
+    choices=["completions_first", "chunks_first"],
+    default="completions_first",
+    help="Order of the nugget creation documents; chunks_first puts the retrieved chunks, shared by battles with the same prompt, ahead of the two completions so that provider-side prompt caching can reuse the prefix.",
+)
+parser.add_argument(
+    "--http_pool_size",
+    type=int,
+    default=64,
+    help="Keep-alive connections shared by all LLM calls of a worker process.",
+)
+parser.add_argument(
+    "--adaptive_concurrency",
+    action="store_true",
+    help="Adapt the number of concurrent LLM calls to rate-limit and timeout responses, up to the engine's worker count.",
+)
+parser.add_argument(
+    "--initial_concurrency",
+    type=int,
+    default=4,
+    help="Starting limit of concurrent LLM calls with --adaptive_concurrency.",
+)
+parser.add_argument(
+    "--deployments_config",
+    type=str,
+    default="",
+    help="JSON list of Azure OpenAI deployments to balance LLM calls over, see src/deployment_pool.py.",
+)
+parser.add_argument(
+    "--call_timeout",
+    type=float,
+    default=None,
+    help="Deadline in seconds for each LLM call, after which it fails and is retried.",
+)
+parser.add_argument(
+    "--hedge_percentile",
+    type=float,
+    default=None,
+    help="Send a duplicate request for LLM calls slower than this latency percentile of the run, e.g. 95.",
+)
+parser.add_argument(
+    "--max_hedge_rate",
+    type=float,
+    default=0.05,
+    help="Largest fraction of LLM calls that may be hedged.",
+)
+parser.add_argument(
+    "--requests_per_minute",
+    type=int,
+    default=None,
+    help="Requests per minute quota of each deployment, shared by all processes using --rate_limit_dir.",
+)
+parser.add_argument(
+    "--tokens_per_minute",
+    type=int,
+    default=None,
+    help="Tokens per minute quota of each deployment, shared by all processes using --rate_limit_dir.",
+)
+parser.add_argument(
+    "--rate_limit_dir",
+    type=str,
+    default=os.path.join(tempfile.gettempdir(), "lmsys_nuggetize_rate_limits"),
+    help="Directory holding the rate limiter's per-model token buckets.",
+)
+parser.add_argument(
+    "--max_cost",
+    type=float,
+    default=None,
+    help="Stop dispatching rows once the run's projected LLM cost in USD would exceed this.",
+)
+parser.add_argument(
+    "--max_hours",
+    type=float,
+    default=None,
+    help="Stop dispatching rows once the run's projected wall-clock time would exceed this.",
+)
+parser.add_argument(
+    "--cache_path",
+    type=str,
+    default="",
+    help="SQLite file for caching LLM responses across runs, disabled when empty.",
+)
+parser.add_argument(
+    "--cache_max_gb",
+    type=float,
+    default=10.0,
+    help="Least recently used responses are evicted beyond this cache size.",
+)
+parser.add_argument(
+    "--replay_only",
+    action="store_true",
+    help="Only serve LLM responses from --cache_path and abort on any cache miss.",
+)
+parser.add_argument(
+    "--trace_path",
+    type=str,
+    default="",
+    help="Append-only trace with one record per LLM call, defaults to path_prefix/llm_trace.jsonl",
+)
+parser.add_argument(
+    "--fsync_interval",
+    type=float,
+    default=5.0,
+    help="Seconds between fsyncs of the streamed results.jsonl and skips journal.",
+)
+parser.add_argument(
+    "--resume",
+    action="store_true",
+    help="Continue an interrupted run using the manifest.jsonl under path_prefix.",
+)
 args = parser.parse_args()
+if args.cascade_model_name and args.joint_assignment:
+    parser.error("--cascade_model_name cannot be combined with --joint_assignment")
 
 # Unpack args
 SAMPLING_RATE = args.sampling_rate
-PATH_PREFIX = args.path_prefix
+SEED = args.seed
+SHARD_ID = args.shard_id
+NUM_SHARDS = args.num_shards
+PATH_PREFIX = shard_path_prefix(args.path_prefix, SHARD_ID, NUM_SHARDS)
 MODEL_NAME = args.model_name
+ASSIGNER_MODEL_NAME = args.assigner_model_name or args.model_name
+STAGE = args.stage
+NUGGETS_PATH_PREFIX = (
+    args.nuggets_path_prefix if STAGE == "assign" and args.nuggets_path_prefix else ""
+) or PATH_PREFIX
 RETRIEVED_RUNFILE = args.retrieved_runfile
 CHUNKS_FILE = args.chunks_file
 MAX_CHUNKS = args.max_chunks
+RESUME = args.resume
+MANIFEST = RunManifest(f"{PATH_PREFIX}/manifest.jsonl")
+# The batch engine stores batch results in the cache for the calls to replay.
+CACHE_PATH = args.cache_path or (
+    f"{PATH_PREFIX}/batches/llm_cache.sqlite" if args.engine == "batch" else ""
+)
+LLM_CACHE = (
+    LLMCache(
+        CACHE_PATH,
+        max_size_bytes=int(args.cache_max_gb * 1024**3),
+        replay_only=args.replay_only,
+    )
+    if CACHE_PATH and not args.dry_run
+    else None
+)
+
+
+def pricing_name(model_name):
+    batch_name = f"{model_name}-batch"
+    if args.engine == "batch" and batch_name in OPENAI_PRICING:
+        return batch_name
+    return model_name
+
+
+# Shared by all worker processes and threads of this invocation.
+BUDGET = (
+    BudgetGovernor(
+        {
+            model_name: OPENAI_PRICING[pricing_name(model_name)]
+            for model_name in [
+                MODEL_NAME,
+                ASSIGNER_MODEL_NAME,
+                args.cascade_model_name,
+            ]
+            if model_name
+        },
+        max_cost=args.max_cost,
+        max_hours=args.max_hours,
+    )
+    if (args.max_cost or args.max_hours) and not args.dry_run
+    else None
+)
+TRACER = CallTracer(args.trace_path or f"{PATH_PREFIX}/llm_trace.jsonl")
+BATCH_RUNNER = (
+    build_batch_runner(
+        LLM_CACHE,
+        args.batch_backend,
+        f"{PATH_PREFIX}/batches",
+        responses_dir=args.batch_responses_dir,
+        max_attempts=args.max_attempts,
+        poll_seconds=args.batch_poll_seconds,
+        deployment_suffix=args.batch_deployment_suffix,
+        budget=BUDGET,
+        tracer=TRACER,
+    )
+    if args.engine == "batch" and not args.dry_run
+    else None
+)
+
+
+def async_in_flight_limits():
+    """Returns the number of concurrent rows of the async engine's two stages.
+
+    Each row has at most one LLM call in flight, so by default the stages
+    share --http_pool_size rows and every call has a connection.
+    """
+    max_in_flight = args.max_in_flight or args.http_pool_size
+    create = args.max_in_flight_create or max(1, (max_in_flight + 1) // 2)
+    assign = args.max_in_flight_assign or max(1, max_in_flight // 2)
+    return create, assign
+
+
+def max_concurrency():
+    if args.engine == "async":
+        return sum(async_in_flight_limits())
+    return args.max_workers
+
+
+# Shared by all worker processes and threads of this invocation.
+CONCURRENCY = (
+    AIMDLimiter(max_concurrency(), initial_limit=args.initial_concurrency)
+    if args.adaptive_concurrency
+    else None
+)
+
+
+def count_tokens(text):
+    encoding = tiktoken.get_encoding(TOKENIZER_OPENAI[MODEL_NAME])
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+RATE_LIMITER = (
+    RateLimiter(
+        args.rate_limit_dir,
+        requests_per_minute=args.requests_per_minute,
+        tokens_per_minute=args.tokens_per_minute,
+        count_tokens=count_tokens,
+    )
+    if (args.requests_per_minute or args.tokens_per_minute) and not args.dry_run
+    else None
+)
+
+HEDGER = (
+    Hedger(args.call_timeout, args.hedge_percentile, args.max_hedge_rate)
+    if (args.call_timeout or args.hedge_percentile) and args.engine != "batch"
+    else None
+)
+HEDGING_DIR = f"{PATH_PREFIX}/hedging"
+NUGGET_POOLS_DIR = f"{PATH_PREFIX}/nugget_pools"
+# Token usage, including provider-side cached_tokens, of each row's calls.
+USAGE = UsageTracker()
+
+# Per-process state, filled in by load_run_inputs and get_nuggetizer.
+DATA_DF = None
+PLAN = None
+QID_TO_DOC_IDS = {}
+CHUNK_STORE = None
+QID_TO_DEDUP = {}
+PROMPT_GROUPS = {}
+NUGGETIZERS = {}
+NUGGETIZER_LOCK = threading.Lock()
 
 
 def get_completion(row, key):
-    message = row[f"messages_{key}"][1]
-    assert message["role"] == "assistant"
-    return message["content"]
+    return row[f"completion_{key}"]
 
 
-def parse_rank_file(retrieved_runfile):
-    qid_to_doc_ids = defaultdict(list)
-    with open(retrieved_runfile, "r") as f:
-        for line in f:
-            parts = line.strip().split()
-            if len(parts) < 6:
-                continue
-            qid, _, doc_id, _, _, _ = parts
-            qid_to_doc_ids[qid].append(doc_id)
-    return qid_to_doc_ids
+def nuggets_path(index, path_prefix=None):
+    path_prefix = path_prefix or PATH_PREFIX
+    return f"{path_prefix}/nuggets/requests_with_nuggets_{index}.json"
 
 
-def load_retrieved_chunks(chunks_file):
-    doc_id_to_chunk = {}
-    with open(chunks_file, "r") as f:
-        for line in f:
-            data = json.loads(line.strip())
-            doc_id_to_chunk[data["_id"]] = data["text"]
-    return doc_id_to_chunk
+def assignments_path(index):
+    return f"{PATH_PREFIX}/assignments/assigned_nuggets_{index}.json"
 
 
-def process_row(index_row_tuple):
-    index, row, retrieved_chunks = index_row_tuple
-    if row["turn"] != 1:
-        return {"skipped_reason": "multi_turn", "question_id": index}
-    if random.random() > SAMPLING_RATE:
-        return {"skipped_reason": "sampling", "question_id": index}
+def compact(scored_nuggets):
+    if not args.compact_nuggets:
+        return scored_nuggets
+    return compact_nuggets(
+        scored_nuggets, args.compaction_threshold, args.compacted_max_nuggets
+    )
 
-    try:
-        query = Query(qid=index, text=get_prompt(row))
-        documents = [
-            Document(docid="a", segment=get_completion(row, "a")),
-            Document(docid="b", segment=get_completion(row, "b")),
+
+def ordered_completions(row, swap):
+    """Returns the row's completions in the order shown to the nuggetizer."""
+    keys = ["b", "a"] if swap else ["a", "b"]
+    return {key: get_completion(row, key) for key in keys}
+
+
+def build_request(index, query_text, completions, retrieved_chunks):
+    """Returns the nugget creation Request and the token counts of packing.
+
+    The completions become documents in their order, with their keys as docids.
+    """
+    token_counts = None
+    if args.token_budget:
+        completions, retrieved_chunks, token_counts = pack_context(
+            tiktoken.get_encoding(TOKENIZER_OPENAI[MODEL_NAME]),
+            completions,
+            retrieved_chunks,
+            args.token_budget,
+            args.max_completion_tokens,
+            args.chunk_truncation,
+        )
+    documents = [Document(docid=key, segment=text) for key, text in completions.items()]
+    chunks = [
+        Document(docid=chunk_id, segment=chunk) for chunk_id, chunk in retrieved_chunks
+    ]
+    if args.context_layout == "chunks_first":
+        # The completions stay adjacent and in the planned order.
+        documents = chunks + documents
+    else:
+        documents = documents + chunks
+    query = Query(qid=index, text=query_text)
+    return Request(query=query, documents=documents), token_counts
+
+
+def run_nugget_creation(index, request, token_counts, nuggetizer):
+    """Creates the nuggets of request and returns them with the nuggets file record."""
+    with USAGE.track() as usage:
+        raw_scored_nuggets = nuggetizer.create(request)
+    if not raw_scored_nuggets:
+        raise ValueError("No nuggets were created.")
+    scored_nuggets = compact(raw_scored_nuggets)
+
+    result = {
+        "question_id": index,
+        "request": dataclasses.asdict(request),
+        "scored_nuggets": [dataclasses.asdict(sn) for sn in scored_nuggets],
+    }
+    if args.compact_nuggets:
+        result["raw_scored_nuggets"] = [
+            dataclasses.asdict(sn) for sn in raw_scored_nuggets
         ]
-        if random.random() > 0.5:
-            documents[0], documents[1] = documents[1], documents[0]
-        for chunk_id, chunk in retrieved_chunks:
-            documents.append(Document(docid=chunk_id, segment=chunk))
-        request = Request(query=query, documents=documents)
-
-        nuggetizer = Nuggetizer(model=MODEL_NAME, use_azure_openai=True)
-        scored_nuggets = nuggetizer.create(request)
-        if not scored_nuggets:
-            raise ValueError("No nuggets were created.")
-
-        with open(
-            f"{PATH_PREFIX}/nuggets/requests_with_nuggets_{index}.json", "w"
-        ) as f:
-            result_str = json.dumps(
-                {
-                    "question_id": index,
-                    "request": dataclasses.asdict(request),
-                    "scored_nuggets": [dataclasses.asdict(sn) for sn in scored_nuggets],
-                },
-                ensure_ascii=False,
+    if token_counts is not None:
+        result["token_counts"] = token_counts
+    if usage:
+        result["usage"] = dict(usage)
+    return scored_nuggets, result
+
+
+def write_nuggets(index, result):
+    if index in QID_TO_DEDUP:
+        result["dedup"] = QID_TO_DEDUP[index]
+    with open(nuggets_path(index), "w") as f:
+        result_str = json.dumps(result, ensure_ascii=False)
+        f.write(result_str)
+        f.write("\n")
+
+
+def create_nuggets(index, row, retrieved_chunks, nuggetizer, swap):
+    request, token_counts = build_request(
+        index, row["prompt"], ordered_completions(row, swap), retrieved_chunks
+    )
+    scored_nuggets, result = run_nugget_creation(
+        index, request, token_counts, nuggetizer
+    )
+    write_nuggets(index, result)
+    return request, scored_nuggets
+
+
+def create_pool(group, nuggetizer):
+    """Creates the nugget pool of a group of battles with the same prompt.
+
+    The documents are the completions of every battle of the group, with the
+    row index prefixed to their docids, and the union of their retrieved chunks.
+    """
+    completions = {}
+    retrieved_chunks = {}
+    for index in group:
+        row = DATA_DF.loc[index]
+        for key, text in ordered_completions(row, PLAN.at[index, "swap"]).items():
+            completions[f"{index}_{key}"] = text
+        for chunk_id, chunk in get_retrieved_chunks(row["question_id"]):
+            retrieved_chunks.setdefault(chunk_id, chunk)
+    request, token_counts = build_request(
+        group[0],
+        DATA_DF.at[group[0], "prompt"],
+        completions,
+        list(retrieved_chunks.items())[:MAX_CHUNKS],
+    )
+    _, pool = run_nugget_creation(group[0], request, token_counts, nuggetizer)
+    pool["question_ids"] = group
+    return pool
+
+
+def create_pooled_nuggets(index, row, nuggetizer):
+    """Saves the nuggets of the row's shared pool, creating the pool if needed.
+
+    Only the row that created the pool records its usage, so usage summed over
+    the nuggets files still counts each call once.
+    """
+    group = PROMPT_GROUPS[index]
+    pool, created = load_or_create_pool(
+        pool_path(NUGGET_POOLS_DIR, group),
+        group,
+        lambda: create_pool(group, nuggetizer),
+    )
+    request = Request(
+        query=Query(qid=index, text=row["prompt"]),
+        documents=[Document(**d) for d in pool["request"]["documents"]],
+    )
+    result = {
+        "question_id": index,
+        "request": dataclasses.asdict(request),
+        "scored_nuggets": pool["scored_nuggets"],
+        "nugget_pool": {"question_ids": pool["question_ids"], "created": created},
+    }
+    for key in ["raw_scored_nuggets", "token_counts"]:
+        if key in pool:
+            result[key] = pool[key]
+    if created and "usage" in pool:
+        result["usage"] = pool["usage"]
+    write_nuggets(index, result)
+    return request, [ScoredNugget(**sn) for sn in pool["scored_nuggets"]]
+
+
+def get_nuggetizer(assigner_model_name=None):
+    """Returns the Nuggetizer of this process, building it on first use.
+
+    All rows handled by the process, from any thread, share the Nuggetizer and
+    its keep-alive connection pool instead of paying client setup and TLS
+    handshakes per row. The assignment cascade uses a second one whose
+    assigner is the cascade model.
+    """
+    assigner_model_name = assigner_model_name or ASSIGNER_MODEL_NAME
+    with NUGGETIZER_LOCK:
+        if assigner_model_name not in NUGGETIZERS:
+            nuggetizer = Nuggetizer(
+                creator_model=MODEL_NAME,
+                scorer_model=MODEL_NAME,
+                assigner_model=assigner_model_name,
+                use_azure_openai=True,
             )
-            f.write(result_str)
-            f.write("\n")
-    except Exception as e:
-        print(f"[{index}] Nugget creation failed: {e}")
-        return {"skipped_reason": "nugget_creation", "question_id": index}
+            if BATCH_RUNNER:
+                # Uncached calls are deferred to the next batch round.
+                wrap_nuggetizer(
+                    nuggetizer, LLM_CACHE.middleware, BATCH_RUNNER.middleware
+                )
+            else:
+                http_client = build_http_client(args.http_pool_size)
+                # The limiter retries overloaded calls itself, after adapting to them.
+                share_http_client(
+                    nuggetizer, http_client, max_retries=0 if CONCURRENCY else None
+                )
+                deployment_pool = (
+                    load_deployment_pool(
+                        args.deployments_config, http_client, RATE_LIMITER
+                    )
+                    if args.deployments_config
+                    else None
+                )
+                wrap_nuggetizer(
+                    nuggetizer,
+                    LLM_CACHE.middleware if LLM_CACHE else None,
+                    TRACER.middleware,
+                    USAGE.middleware,
+                    CONCURRENCY.middleware if CONCURRENCY else None,
+                    HEDGER.middleware if HEDGER else None,
+                    BUDGET.middleware if BUDGET else None,
+                    # A pool paces each of its deployments itself.
+                    (
+                        RATE_LIMITER.middleware
+                        if RATE_LIMITER and not deployment_pool
+                        else None
+                    ),
+                    deployment_pool.middleware if deployment_pool else None,
+                )
+            TRACER.tag_nuggetizer(nuggetizer)
+            NUGGETIZERS[assigner_model_name] = nuggetizer
+    return NUGGETIZERS[assigner_model_name]
 
-    try:
-        assigned_nuggets = {}
-        metrics = {}
-        completions = {}
 
-        for key in ["a", "b"]:
-            completions[key] = get_completion(row, key)
+def init_worker(concurrency, budget):
+    global CONCURRENCY, BUDGET
+    CONCURRENCY = concurrency
+    BUDGET = budget
+    if HEDGER:
+        # Pool workers skip atexit handlers, but run multiprocessing finalizers.
+        multiprocessing.util.Finalize(
+            None, HEDGER.dump, args=(HEDGING_DIR,), exitpriority=10
+        )
+    # Forked workers inherit the inputs loaded by the parent; spawned ones reload.
+    if DATA_DF is None:
+        load_run_inputs()
+    get_nuggetizer()
+
+
+def load_nuggets(index):
+    with open(nuggets_path(index, NUGGETS_PATH_PREFIX), "r") as f:
+        data = json.loads(f.readline())
+    request = Request(
+        query=Query(**data["request"]["query"]),
+        documents=[Document(**d) for d in data["request"]["documents"]],
+    )
+    # Reassignment starts over from the nuggets as created, before compaction.
+    raw_scored_nuggets = data.get("raw_scored_nuggets", data["scored_nuggets"])
+    scored_nuggets = compact([ScoredNugget(**sn) for sn in raw_scored_nuggets])
+    return request, scored_nuggets
+
+
+def is_cascade_holdout(index):
+    return hash_unit_interval([index], SEED, "cascade_holdout")[0] < (
+        args.cascade_holdout_rate
+    )
+
+
+def assign_nuggets(index, row, request, scored_nuggets, nuggetizer):
+    assigned_nuggets = {}
+    metrics = {}
+    completions = {key: get_completion(row, key) for key in ["a", "b"]}
+    joint_fallbacks = None
+    cascade_stats = {}
+
+    if args.joint_assignment:
+        assigned_nuggets, joint_fallbacks = assign_jointly(
+            nuggetizer, request.query.text, completions, scored_nuggets
+        )
+    for key in ["a", "b"]:
+        if args.cascade_model_name:
+            assigned_nuggets[key], cascade_stats[key] = cascade_assign(
+                get_nuggetizer(args.cascade_model_name),
+                nuggetizer,
+                request.query.text,
+                completions[key],
+                scored_nuggets,
+                args.cascade_samples,
+                holdout=is_cascade_holdout(index),
+            )
+        elif not args.joint_assignment:
             assigned_nuggets[key] = nuggetizer.assign(
-                query.text, completions[key], scored_nuggets
+                request.query.text, completions[key], scored_nuggets
             )
-            nugget_list = [
-                {"text": n.text, "importance": n.importance, "assignment": n.assignment}
-                for n in assigned_nuggets[key]
+        nugget_list = [
+            {"text": n.text, "importance": n.importance, "assignment": n.assignment}
+            for n in assigned_nuggets[key]
+        ]
+        metrics[key] = calculate_nugget_scores(request.query.qid, nugget_list)
+
+    with open(assignments_path(index), "w") as f2:
+        result = {"question_id": index, "winner": row["winner"]}
+        for key in ["a", "b"]:
+            result[f"completion_{key}"] = completions[key]
+            result[f"assigned_nuggets_{key}"] = [
+                dataclasses.asdict(an) for an in assigned_nuggets[key]
             ]
-            metrics[key] = calculate_nugget_scores(request.query.qid, nugget_list)
-
-        with open(
-            f"{PATH_PREFIX}/assignments/assigned_nuggets_{index}.json", "w"
-        ) as f2:
-            result = {"question_id": index, "winner": row["winner"]}
-            for key in ["a", "b"]:
-                result[f"completion_{key}"] = completions[key]
-                result[f"assigned_nuggets_{key}"] = [
-                    dataclasses.asdict(an) for an in assigned_nuggets[key]
-                ]
-                result[f"metrics_{key}"] = metrics[key].__dict__
-            result_str = json.dumps(result, ensure_ascii=False)
-            f2.write(result_str)
-            f2.write("\n")
+            result[f"metrics_{key}"] = metrics[key].__dict__
+        if joint_fallbacks is not None:
+            # Windows whose joint answer could not be parsed.
+            result["joint_assignment_fallbacks"] = joint_fallbacks
+        if cascade_stats:
+            result["cascade"] = cascade_stats
+        result_str = json.dumps(result, ensure_ascii=False)
+        f2.write(result_str)
+        f2.write("\n")
+
+    return {
+        "question_id": index,
+        "winner": row["winner"],
+        "metrics_a": metrics["a"].__dict__,
+        "metrics_b": metrics["b"].__dict__,
+        "skipped_reason": None,
+    }
+
 
+def planned_skip(index, skipped_reason, previous_skips):
+    """Returns the skip for a row that needs no LLM calls, or None."""
+    if STAGE == "assign":
+        # Every row with saved nuggets is reassigned, whatever the sampling rate.
+        if os.path.exists(nuggets_path(index, NUGGETS_PATH_PREFIX)):
+            return None
+        reason = previous_skips.get(index, skipped_reason or "nugget_creation")
+        return {"skipped_reason": reason, "question_id": index}
+    if skipped_reason:
+        return {"skipped_reason": skipped_reason, "question_id": index}
+    return None
+
+
+def create_row(index, start_stage):
+    row = DATA_DF.loc[index]
+    try:
+        with TRACER.context(question_id=int(index)):
+            if start_stage == "assign":
+                request, scored_nuggets = load_nuggets(index)
+            elif len(PROMPT_GROUPS.get(index, [])) > 1:
+                request, scored_nuggets = create_pooled_nuggets(
+                    index, row, get_nuggetizer()
+                )
+                MANIFEST.record(index, CREATED)
+            else:
+                request, scored_nuggets = create_nuggets(
+                    index,
+                    row,
+                    get_retrieved_chunks(row["question_id"]),
+                    get_nuggetizer(),
+                    PLAN.at[index, "swap"],
+                )
+                MANIFEST.record(index, CREATED)
+    except Exception as e:
+        print(f"[{index}] Nugget creation failed: {e}")
         return {
+            "skipped_reason": "nugget_creation",
             "question_id": index,
-            "winner": row["winner"],
-            "metrics_a": metrics["a"].__dict__,
-            "metrics_b": metrics["b"].__dict__,
-            "skipped_reason": None,
+            "error": repr(e),
         }
+    return {
+        "question_id": index,
+        "request": request,
+        "scored_nuggets": scored_nuggets,
+        "skipped_reason": None,
+    }
 
+
+def assign_row(index, request, scored_nuggets):
+    row = DATA_DF.loc[index]
+    try:
+        with TRACER.context(question_id=int(index)):
+            return assign_nuggets(index, row, request, scored_nuggets, get_nuggetizer())
     except Exception as e:
         print(f"[{index}] Nugget assignment failed: {e}")
-        return {"skipped_reason": "nugget_assignment", "question_id": index}
+        return {
+            "skipped_reason": "nugget_assignment",
+            "question_id": index,
+            "error": repr(e),
+        }
 
 
-def create_and_assign_nuggets_parallel(max_workers):
-    os.makedirs(f"{PATH_PREFIX}/nuggets", exist_ok=True)
-    os.makedirs(f"{PATH_PREFIX}/assignments", exist_ok=True)
-    data = load_dataset("lmarena-ai/search-arena-v1-7k", split="test")
-    data_df = data.to_pandas()
+def process_row(index_stage_tuple):
+    index, start_stage = index_stage_tuple
+    created = create_row(index, start_stage)
+    if created["skipped_reason"]:
+        return created
+    return assign_row(index, created["request"], created["scored_nuggets"])
+
+
+def load_finished_result(index, entry):
+    """Returns the recorded outcome of a row finished by an earlier run, if any."""
+    if entry is None:
+        return None
+    if entry["state"] == SKIPPED:
+        return {"skipped_reason": entry["reason"], "question_id": index}
+    if entry["state"] == ASSIGNED and os.path.exists(assignments_path(index)):
+        with open(assignments_path(index), "r") as f:
+            assignment = json.loads(f.readline())
+        return {
+            "question_id": index,
+            "winner": assignment["winner"],
+            "metrics_a": assignment["metrics_a"],
+            "metrics_b": assignment["metrics_b"],
+            "skipped_reason": None,
+        }
+    return None
+
+
+def resume_stage(index, entry):
+    """Restarts from assignment when an earlier run already saved the nuggets."""
+    if (
+        entry is not None
+        and os.path.exists(nuggets_path(index))
+        and (
+            entry["state"] == CREATED
+            or (entry["state"] == FAILED and entry["reason"] == "nugget_assignment")
+        )
+    ):
+        return "assign"
+    return "create"
+
 
-    results = []
-    skip_logs = {
+def start_stage(index, entry):
+    if STAGE == "assign":
+        return "assign"
+    return resume_stage(index, entry)
+
+
+def load_resume_states():
+    if RESUME:
+        states = MANIFEST.load()
+        print(f"Resuming from {len(states)} questions recorded in {MANIFEST.path}")
+        return states
+    MANIFEST.reset()
+    return {}
+
+
+def load_retrieved_doc_ids_per_query(question_ids):
+    """Maps each of question_ids to the ids of the chunks used for nugget creation.
+
+    Chunk texts stay in the memory-mapped CHUNK_STORE and are only read when
+    a row is processed.
+    """
+    global CHUNK_STORE
+    qids_to_docids = load_rank_file(RETRIEVED_RUNFILE) if RETRIEVED_RUNFILE else {}
+    question_ids = set(question_ids)
+    qids_to_docids = {
+        int(qid): doc_ids[:MAX_CHUNKS]
+        for qid, doc_ids in qids_to_docids.items()
+        if int(qid) in question_ids
+    }
+    CHUNK_STORE = ChunkStore(CHUNKS_FILE) if CHUNKS_FILE else None
+    signatures = {}
+    if args.dedup_chunks and CHUNKS_FILE:
+        referenced = {d for doc_ids in qids_to_docids.values() for d in doc_ids}
+        signatures = load_signatures(signatures_path(CHUNKS_FILE), referenced)
+    encoding = tiktoken.get_encoding(TOKENIZER_OPENAI[MODEL_NAME])
+
+    qid_to_doc_ids = {}
+    for qid, doc_ids in qids_to_docids.items():
+        if signatures:
+            # Duplicates are dropped from the chunks that would have been sent,
+            # without backfilling lower-ranked chunks, so the removed tokens
+            # are saved.
+            doc_ids, removed = drop_near_duplicates(
+                doc_ids, signatures, args.dedup_max_distance
+            )
+            QID_TO_DEDUP[qid] = {
+                "chunks_removed": len(removed),
+                "tokens_removed": sum(
+                    len(tokens)
+                    for tokens in encoding.encode_batch(
+                        [CHUNK_STORE[d] for d in removed], disallowed_special=()
+                    )
+                ),
+            }
+        qid_to_doc_ids[qid] = doc_ids
+    if QID_TO_DEDUP:
+        chunks = sum(d["chunks_removed"] for d in QID_TO_DEDUP.values())
+        tokens = sum(d["tokens_removed"] for d in QID_TO_DEDUP.values())
+        print(f"Near-duplicate removal dropped {chunks} chunks ({tokens} tokens)")
+    return qid_to_doc_ids
+
+
+def get_retrieved_chunks(question_id):
+    return [
+        (doc_id, CHUNK_STORE[doc_id]) for doc_id in QID_TO_DOC_IDS.get(question_id, [])
+    ]
+
+
+def load_previous_skips():
+    """Maps question_id to its skip reason in the run that produced the nuggets.
+
+    Must be called before open_result_sink, which replaces skips.json when the
+    nuggets were produced under the same path prefix.
+    """
+    path = f"{NUGGETS_PATH_PREFIX}/skips.json"
+    if STAGE != "assign" or not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        skips = json.load(f)
+    return {qid: reason for reason, qids in skips.items() for qid in qids}
+
+
+def load_data_df():
+    return load_arena_df(
+        ["question_id", "turn", "winner", "prompt", "completion_a", "completion_b"]
+    )
+
+
+def load_run_inputs():
+    """Loads the dataset and retrieved chunks that workers look rows up in."""
+    global DATA_DF, PLAN, QID_TO_DOC_IDS, PROMPT_GROUPS
+    DATA_DF = load_data_df()
+    PLAN = plan_rows(DATA_DF, SAMPLING_RATE, SEED, SHARD_ID, NUM_SHARDS)
+    planned = PLAN.index[PLAN["skipped_reason"].isna()]
+    QID_TO_DOC_IDS = load_retrieved_doc_ids_per_query(PLAN.loc[planned, "question_id"])
+    if args.shared_nugget_pool:
+        PROMPT_GROUPS = group_by_prompt(DATA_DF.loc[planned, "prompt"])
+
+
+def update_progress(progress):
+    progress.update(1)
+    postfix = {}
+    if CONCURRENCY:
+        postfix["concurrency"] = CONCURRENCY.limit
+    if BUDGET:
+        BUDGET.finish_row()
+        postfix["cost"] = f"${BUDGET.cost:.2f}"
+    if postfix:
+        progress.set_postfix(postfix, refresh=False)
+
+
+def out_of_budget(in_flight):
+    """Whether --max_cost or --max_hours leaves no room to dispatch another row."""
+    if BUDGET is None:
+        return False
+    stopped = BUDGET.stopped
+    if BUDGET.allows(in_flight):
+        return False
+    if not stopped:
+        print(
+            "Budget reached, finishing the rows in flight: "
+            f"{json.dumps(BUDGET.summary())}"
+        )
+    return True
+
+
+def new_skip_logs():
+    return {
         "nugget_creation": [],
         "nugget_assignment": [],
         "multi_turn": [],
     }
-    qids_to_docids = parse_rank_file(RETRIEVED_RUNFILE) if RETRIEVED_RUNFILE else {}
-    docid_to_chunk = load_retrieved_chunks(CHUNKS_FILE) if CHUNKS_FILE else {}
-    qid_to_chunks = defaultdict(list)
-    for qid, doc_ids in qids_to_docids.items():
-        qid_to_chunks[int(qid)] = [
-            (doc_id, docid_to_chunk[doc_id]) for doc_id in doc_ids[:MAX_CHUNKS]
-        ]
-    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+
+
+def collect_new_result(result, sink):
+    MANIFEST.record_result(result)
+    result.pop("error", None)
+    sink.write(result)
+
+
+def open_result_sink():
+    return ResultSink(PATH_PREFIX, new_skip_logs(), args.fsync_interval)
+
+
+def iter_row_tasks(plan, resume_states, previous_skips, sink):
+    """Yields (index, start_stage) for rows that need LLM calls.
+
+    Rows finished by an earlier run or skipped up front are collected directly.
+    """
+    for index, skipped_reason in plan["skipped_reason"].items():
+        entry = resume_states.get(index)
+        finished = load_finished_result(index, entry)
+        if finished is not None:
+            sink.write(finished)
+            continue
+        skip = planned_skip(index, skipped_reason, previous_skips)
+        if skip is not None:
+            collect_new_result(skip, sink)
+            continue
+        yield index, start_stage(index, entry)
+
+
+def create_and_assign_nuggets_parallel(max_workers):
+    load_run_inputs()
+    resume_states = load_resume_states()
+    previous_skips = load_previous_skips()
+    sink = open_result_sink()
+    with ProcessPoolExecutor(
+        max_workers=max_workers,
+        initializer=init_worker,
+        initargs=(CONCURRENCY, BUDGET),
+    ) as executor:
         futures = {
-            executor.submit(
-                process_row, (index, row, qid_to_chunks[row["question_id"]])
-            ): index
-            for index, row in data_df.iterrows()
+            executor.submit(process_row, task): task[0]
+            for task in iter_row_tasks(PLAN, resume_states, previous_skips, sink)
         }
-        for future in tqdm(as_completed(futures), total=data_df.shape[0]):
-            result = future.result()
-            if result.get("skipped_reason"):
-                reason = result["skipped_reason"]
-                skip_logs.setdefault(reason, []).append(result["question_id"])
+        progress = tqdm(total=len(futures))
+        for future in as_completed(futures):
+            if future.cancelled():
+                continue
+            collect_new_result(future.result(), sink)
+            update_progress(progress)
+            if out_of_budget(max_workers):
+                # Rows already handed to a worker still finish.
+                for pending in futures:
+                    pending.cancel()
+        progress.close()
+
+    sink.close()
+
+
+async def create_and_assign_nuggets_async(max_in_flight_create, max_in_flight_assign):
+    """Runs nugget creation and assignment as two pipelined stages in one process.
+
+    Each stage has its own bounded queue and its own pool of worker threads, so
+    rows whose nuggets are ready are assigned while later rows are still being
+    created. Rows are pulled from the dataset lazily as the creation queue
+    drains, instead of being submitted all at once. The rows run on threads
+    because the LLM cache, limiters and tracer wrap the synchronous client;
+    nuggetizer's AsyncNuggetizer would bypass them.
+    """
+    if max_in_flight_create + max_in_flight_assign > args.http_pool_size:
+        print(
+            f"{max_in_flight_create + max_in_flight_assign} rows in flight share "
+            f"{args.http_pool_size} connections, consider raising --http_pool_size"
+        )
+    load_run_inputs()
+    resume_states = load_resume_states()
+    previous_skips = load_previous_skips()
+    sink = open_result_sink()
+
+    loop = asyncio.get_running_loop()
+    create_executor = ThreadPoolExecutor(max_workers=max_in_flight_create)
+    assign_executor = ThreadPoolExecutor(max_workers=max_in_flight_assign)
+    create_queue = asyncio.Queue(maxsize=max_in_flight_create)
+    assign_queue = asyncio.Queue(maxsize=max_in_flight_assign)
+    progress = tqdm()
+
+    def finish(result):
+        collect_new_result(result, sink)
+        update_progress(progress)
+
+    async def create_worker():
+        while (item := await create_queue.get()) is not None:
+            created = await loop.run_in_executor(create_executor, create_row, *item)
+            if created["skipped_reason"]:
+                finish(created)
             else:
-                del result["skipped_reason"]
-                results.append(result)
+                await assign_queue.put(
+                    (item[0], created["request"], created["scored_nuggets"])
+                )
+
+    async def assign_worker():
+        while (item := await assign_queue.get()) is not None:
+            finish(await loop.run_in_executor(assign_executor, assign_row, *item))
+
+    create_workers = [
+        asyncio.create_task(create_worker()) for _ in range(max_in_flight_create)
+    ]
+    assign_workers = [
+        asyncio.create_task(assign_worker()) for _ in range(max_in_flight_assign)
+    ]
+
+    async def feed():
+        dispatched = 0
+        for item in iter_row_tasks(PLAN, resume_states, previous_skips, sink):
+            # Rows without LLM calls are still collected by iter_row_tasks.
+            if out_of_budget(dispatched - progress.n):
+                continue
+            await create_queue.put(item)
+            dispatched += 1
+        for _ in create_workers:
+            await create_queue.put(None)
+        await asyncio.gather(*create_workers)
+        for _ in assign_workers:
+            await assign_queue.put(None)
+        await asyncio.gather(*assign_workers)
+
+    tasks = [asyncio.create_task(feed()), *create_workers, *assign_workers]
+    try:
+        # A worker killed by an aborted call, such as a CacheMissError with
+        # --replay_only, would otherwise leave feed() blocked on a full queue.
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        for task in tasks:
+            if task.done() and not task.cancelled() and task.exception():
+                for other in tasks:
+                    other.cancel()
+                raise task.exception()
+    finally:
+        progress.close()
+        create_executor.shutdown(wait=True)
+        assign_executor.shutdown(wait=True)
+
+    sink.close()
+
+
+def run_queue_worker(max_workers):
+    """Processes rows leased from the shared job table until none are left.
+
+    Several invocations, on one or more hosts, can work on the same run. The
+    first to start fills the job table from the plan. The one worker that
+    claims the drained table writes results.jsonl and skips.json and drops the
+    shared nugget pools, which no row needs anymore.
+    """
+    load_run_inputs()
+    queue = WorkQueue(args.queue_db or f"{PATH_PREFIX}/jobs.sqlite", args.max_attempts)
+    previous_skips = load_previous_skips()
+    jobs, skips = [], []
+    for index, skipped_reason in PLAN["skipped_reason"].items():
+        skip = planned_skip(index, skipped_reason, previous_skips)
+        if skip is None:
+            jobs.append((index, start_stage(index, None)))
+        else:
+            skips.append((index, skip["skipped_reason"]))
+    queue.populate(jobs, skips)
+    worker_prefix = f"{socket.gethostname()}:{os.getpid()}"
+    progress = tqdm(desc="rows processed by this worker")
+
+    def work(thread_index):
+        worker = f"{worker_prefix}:{thread_index}"
+        while (
+            not out_of_budget(max_workers - 1)
+            and (job := queue.lease(worker, args.lease_seconds)) is not None
+        ):
+            index, stage = job
+            result = process_row((index, stage))
+            MANIFEST.record_result(result)
+            retry_stage = stage
+            if result["skipped_reason"] == "nugget_assignment":
+                retry_stage = "assign"
+            queue.finish(index, worker, result, retry_stage)
+            update_progress(progress)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(work, range(max_workers)))
+    progress.close()
+
+    print(f"Job table: {queue.counts()}")
+    if queue.claim_finalization(worker_prefix):
+        sink = open_result_sink()
+        for result in queue.collect():
+            sink.write(result)
+        sink.close()
+        shutil.rmtree(NUGGET_POOLS_DIR, ignore_errors=True)
+
+
+def process_batch_row(task):
+    """Runs a row until its first LLM call that is not cached yet.
+
+    Returns the row's result, or the (index, stage) to retry it with after the
+    next batch round.
+    """
+    index, stage = task
+    try:
+        created = create_row(index, stage)
+    except BatchDeferred:
+        return None, (index, stage)
+    except BatchItemFailed as e:
+        print(f"[{index}] Nugget creation failed: {e}")
+        return {"skipped_reason": "nugget_creation", "question_id": index}, None
+    if created["skipped_reason"]:
+        return created, None
+    try:
+        result = assign_row(index, created["request"], created["scored_nuggets"])
+    except BatchDeferred:
+        return None, (index, "assign")
+    except BatchItemFailed as e:
+        print(f"[{index}] Nugget assignment failed: {e}")
+        result = {"skipped_reason": "nugget_assignment", "question_id": index}
+    return result, None
+
+
+def create_and_assign_nuggets_batch(max_workers):
+    """Processes all rows through rounds of Batch API jobs, see src/batch_api.py.
+
+    Each round advances every unfinished row by one LLM call; finished rows
+    are written out as in the other engines.
+    """
+    load_run_inputs()
+    resume_states = load_resume_states()
+    previous_skips = load_previous_skips()
+    sink = open_result_sink()
+    tasks = list(iter_row_tasks(PLAN, resume_states, previous_skips, sink))
+    progress = tqdm(total=len(tasks))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while tasks:
+            next_tasks = []
+            for result, retry in executor.map(process_batch_row, tasks):
+                if retry is not None:
+                    next_tasks.append(retry)
+                else:
+                    collect_new_result(result, sink)
+                    update_progress(progress)
+            tasks = next_tasks
+            if tasks:
+                if out_of_budget(len(tasks) - 1):
+                    break
+                succeeded, failed = BATCH_RUNNER.run_round()
+                print(f"Batch round done: {succeeded} succeeded, {failed} failed")
+    progress.close()
+    sink.close()
+
+
+def report_hedging():
+    """Writes the deadline and hedging stats of all processes of the run."""
+    if HEDGER.calls:
+        HEDGER.dump(HEDGING_DIR)
+    summary = summarize_hedging(HEDGING_DIR)
+    print(f"Hedging: {json.dumps(summary)}")
+    with open(f"{PATH_PREFIX}/hedging_summary.json", "w") as f:
+        json.dump(summary, f, indent=2)
+
 
-    print("done with all runs, saving aggregated results.")
-    with open(f"{PATH_PREFIX}/results.jsonl", "w") as results_file:
-        for res in results:
-            json.dump(res, results_file)
-            results_file.write("\n")
+def report_cascade():
+    """Writes the escalation rate and held-out agreement of the cascade."""
+    stats = []
+    for index in PLAN.index:
+        if not os.path.exists(assignments_path(index)):
+            continue
+        with open(assignments_path(index), "r") as f:
+            stats.extend(json.loads(f.readline()).get("cascade", {}).values())
+    summary = summarize_cascade(stats)
+    print(f"Assignment cascade: {json.dumps(summary)}")
+    with open(f"{PATH_PREFIX}/cascade_summary.json", "w") as f:
+        json.dump(summary, f, indent=2)
 
-    with open(f"{PATH_PREFIX}/skips.json", "w") as skipped_file:
-        json.dump(skip_logs, skipped_file)
-        skipped_file.write("\n")
+
+def report_trace():
+    """Writes the per-stage latency, throughput and error rates of the LLM calls."""
+    if not os.path.exists(TRACER.path):
+        return
+    summary = summarize_trace(TRACER.path)
+    with open(f"{PATH_PREFIX}/llm_trace_summary.json", "w") as f:
+        json.dump(summary, f, indent=2)
+
+
+def report_budget():
+    """Writes the spend of the run and whether the budget stopped it."""
+    summary = BUDGET.summary()
+    print(f"Budget: {json.dumps(summary)}")
+    with open(f"{PATH_PREFIX}/budget.json", "w") as f:
+        json.dump(summary, f, indent=2)
+
+
+def dry_run():
+    load_run_inputs()
+    planned = PLAN[PLAN["skipped_reason"].isna()]
+    qid_to_chunks = {qid: get_retrieved_chunks(qid) for qid in planned["question_id"]}
+    report = estimate_run_cost(
+        DATA_DF.loc[planned.index],
+        qid_to_chunks,
+        pricing_name(MODEL_NAME),
+        pricing_name(ASSIGNER_MODEL_NAME),
+        joint_assignment=args.joint_assignment,
+    )
+    report["skipped"] = PLAN["skipped_reason"].value_counts().to_dict()
+    if PROMPT_GROUPS:
+        # The estimate above still counts one nugget creation per row.
+        pools = {group[0]: len(group) for group in PROMPT_GROUPS.values()}
+        report["shared_nugget_pools"] = {
+            "pools": sum(size > 1 for size in pools.values()),
+            "rows": sum(size for size in pools.values() if size > 1),
+        }
+    print(json.dumps(report, indent=2))
+
+
+def run():
+    """Processes the planned rows with the chosen engine and writes the reports."""
+    os.makedirs(f"{PATH_PREFIX}/nuggets", exist_ok=True)
+    os.makedirs(f"{PATH_PREFIX}/assignments", exist_ok=True)
+    if args.engine != "queue" and not RESUME:
+        TRACER.reset()
+        # Pools of an earlier run may come from other models or settings.
+        shutil.rmtree(NUGGET_POOLS_DIR, ignore_errors=True)
+        if HEDGER:
+            shutil.rmtree(HEDGING_DIR, ignore_errors=True)
+    if args.engine == "batch":
+        create_and_assign_nuggets_batch(max_workers=args.max_workers)
+    elif args.engine == "queue":
+        run_queue_worker(max_workers=args.max_workers)
+    elif args.engine == "async":
+        asyncio.run(create_and_assign_nuggets_async(*async_in_flight_limits()))
+    else:
+        create_and_assign_nuggets_parallel(max_workers=args.max_workers)
+    if HEDGER:
+        report_hedging()
+    if args.cascade_model_name:
+        report_cascade()
+    if BUDGET:
+        report_budget()
+    report_trace()
 
 
 if __name__ == "__main__":
-    create_and_assign_nuggets_parallel(max_workers=args.max_workers)
+    # A dry run only reads its inputs and writes nothing under the path prefix.
+    if args.dry_run:
+        dry_run()
+    else:
+        run()
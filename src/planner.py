@@ -0,0 +1,164 @@
+import hashlib
+import math
+
+import numpy as np
+import pandas as pd
+import tiktoken
+
+from src.analysis.openai_client import OPENAI_PRICING, TOKENIZER_OPENAI
+
+# Rough shape of the Nuggetizer prompts, used only for dry-run estimates.
+WINDOW_SIZE = 10
+MAX_NUGGETS = 30
+NUGGET_TOKENS = 15
+PROMPT_OVERHEAD_TOKENS = 300
+SCORE_LABEL_TOKENS = 4
+ASSIGN_LABEL_TOKENS = 6
+
+
+def hash_unit_interval(question_ids, seed, salt):
+    """Maps question ids to stable pseudo-random floats in [0, 1).
+
+    The value only depends on the question id, the seed and the salt, so the
+    same rows are drawn no matter which worker handles them or in what order.
+    Different salts give independent values for the same question id.
+    """
+    hashes = np.fromiter(
+        (
+            # The top 53 bits of the hash, which a float64 holds exactly.
+            int.from_bytes(
+                hashlib.blake2b(
+                    f"{salt}:{seed}:{question_id}".encode("utf-8"), digest_size=8
+                ).digest(),
+                "little",
+            )
+            >> 11
+            for question_id in question_ids
+        ),
+        dtype=np.float64,
+    )
+    return hashes / np.float64(2**53)
+
+
+def shard_ids(question_ids, num_shards):
+    """Assigns each question id to one of num_shards shards, independent of seed."""
+    return (hash_unit_interval(question_ids, 0, "shard") * num_shards).astype(np.int64)
+
+
+def shard_path_prefix(path_prefix, shard_id, num_shards):
+    if num_shards == 1:
+        return path_prefix
+    return f"{path_prefix}/shard_{shard_id}_of_{num_shards}"
+
+
+def plan_rows(data_df, sampling_rate, seed, shard_id=0, num_shards=1):
+    """Decides up front which rows to process and how to order each pair.
+
+    Returns a frame indexed like data_df, restricted to the rows of the given
+    shard, with a skipped_reason column (None for rows to process) and a swap
+    column telling whether completion b is shown to the nuggetizer before
+    completion a.
+    """
+    if num_shards > 1:
+        in_shard = shard_ids(data_df["question_id"].to_numpy(), num_shards) == shard_id
+        data_df = data_df[in_shard]
+    question_ids = data_df["question_id"].to_numpy()
+    multi_turn = data_df["turn"].to_numpy() != 1
+    sampled_out = hash_unit_interval(question_ids, seed, "sampling") >= sampling_rate
+    return pd.DataFrame(
+        {
+            "question_id": question_ids,
+            "skipped_reason": np.where(
+                multi_turn, "multi_turn", np.where(sampled_out, "sampling", None)
+            ),
+            "swap": hash_unit_interval(question_ids, seed, "swap") < 0.5,
+        },
+        index=data_df.index,
+    )
+
+
+def count_tokens(encoding, texts):
+    return np.array(
+        [len(tokens) for tokens in encoding.encode_batch(texts, disallowed_special=())],
+        dtype=np.int64,
+    )
+
+
+def estimate_run_cost(
+    data_df, qid_to_chunks, model_name, assigner_model_name, joint_assignment=False
+):
+    """Estimates prompt/completion tokens and cost of nuggetizing data_df's rows.
+
+    Prompt tokens of the inputs are counted exactly; the fixed instructions,
+    nugget lists and outputs are approximated from the constants above.
+    """
+    encoding = tiktoken.get_encoding(TOKENIZER_OPENAI[model_name])
+    query = count_tokens(encoding, data_df["prompt"].tolist())
+    completions = {
+        key: count_tokens(encoding, data_df[f"completion_{key}"].tolist())
+        for key in ["a", "b"]
+    }
+
+    chunk_texts = {
+        chunk_id: text
+        for qid in data_df["question_id"]
+        for chunk_id, text in qid_to_chunks.get(qid, [])
+    }
+    chunk_tokens = dict(
+        zip(chunk_texts, count_tokens(encoding, list(chunk_texts.values())))
+    )
+    retrieved = np.array(
+        [
+            sum(chunk_tokens[chunk_id] for chunk_id, _ in qid_to_chunks.get(qid, []))
+            for qid in data_df["question_id"]
+        ],
+        dtype=np.int64,
+    )
+    num_documents = 2 + np.array(
+        [len(qid_to_chunks.get(qid, [])) for qid in data_df["question_id"]]
+    )
+
+    nugget_list = MAX_NUGGETS * NUGGET_TOKENS
+    create_windows = np.ceil(num_documents / WINDOW_SIZE)
+    nugget_windows = math.ceil(MAX_NUGGETS / WINDOW_SIZE)
+    tokens = {
+        "create": {
+            "prompt": completions["a"]
+            + completions["b"]
+            + retrieved
+            + create_windows * (2 * query + PROMPT_OVERHEAD_TOKENS + nugget_list),
+            "completion": create_windows * nugget_list,
+        },
+        "score": {
+            "prompt": nugget_windows * (query + PROMPT_OVERHEAD_TOKENS) + nugget_list,
+            "completion": np.full(len(data_df), MAX_NUGGETS * SCORE_LABEL_TOKENS),
+        },
+        "assign": {
+            "prompt": (
+                nugget_windows
+                * (query + completions["a"] + completions["b"] + PROMPT_OVERHEAD_TOKENS)
+                + nugget_list
+                if joint_assignment
+                else sum(
+                    nugget_windows * (query + completions[key] + PROMPT_OVERHEAD_TOKENS)
+                    + nugget_list
+                    for key in ["a", "b"]
+                )
+            ),
+            "completion": np.full(len(data_df), 2 * MAX_NUGGETS * ASSIGN_LABEL_TOKENS),
+        },
+    }
+
+    report = {"rows": int(len(data_df)), "stages": {}, "estimated_cost": 0.0}
+    for stage, counts in tokens.items():
+        price = OPENAI_PRICING[assigner_model_name if stage == "assign" else model_name]
+        prompt_tokens = int(np.sum(counts["prompt"]))
+        completion_tokens = int(np.sum(counts["completion"]))
+        cost = prompt_tokens * price["input"] + completion_tokens * price["output"]
+        report["stages"][stage] = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "estimated_cost": cost,
+        }
+        report["estimated_cost"] += cost
+    return report
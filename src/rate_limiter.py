@@ -0,0 +1,120 @@
+"""Token buckets that pace LLM calls to a deployment's RPM and TPM quotas.
+
+The bucket levels of each model, or of each deployment of a
+src.deployment_pool.DeploymentPool, are kept in a small file under a shared
+directory and updated under an exclusive file lock, so all threads and
+processes on a host that use the same directory draw from the same budget,
+including separate invocations such as shards or query categorization.
+"""
+
+import fcntl
+import os
+import struct
+import time
+
+# Requests made without a completion cap are budgeted at this many tokens.
+DEFAULT_COMPLETION_TOKENS = 512
+# Azure enforces quotas over short windows, so at most this many seconds of
+# quota may be spent in one burst.
+BURST_SECONDS = 10.0
+STATE_FORMAT = "ddd"
+
+
+def estimate_tokens(count_tokens, kwargs):
+    """Estimates the quota a chat completion request counts against."""
+    prompt_tokens = sum(
+        count_tokens(message["content"])
+        for message in kwargs.get("messages", [])
+        if isinstance(message.get("content"), str)
+    )
+    completion_tokens = (
+        kwargs.get("max_completion_tokens")
+        or kwargs.get("max_tokens")
+        or DEFAULT_COMPLETION_TOKENS
+    )
+    return prompt_tokens + completion_tokens * (kwargs.get("n") or 1)
+
+
+class RateLimiter:
+    """Cross-process requests-per-minute and tokens-per-minute limiter.
+
+    Either quota may be None to leave it unlimited. Token estimates made with
+    count_tokens before a call are corrected with the reported usage after it.
+    """
+
+    def __init__(
+        self,
+        directory,
+        requests_per_minute=None,
+        tokens_per_minute=None,
+        count_tokens=None,
+    ):
+        self.directory = directory
+        self.requests_per_second = (requests_per_minute or 0) / 60
+        self.tokens_per_second = (tokens_per_minute or 0) / 60
+        self.count_tokens = count_tokens or (lambda text: len(text) // 4)
+        os.makedirs(directory, exist_ok=True)
+
+    def _state_path(self, model):
+        return os.path.join(self.directory, f"{model}.bucket")
+
+    def _update(self, model, requests, tokens, force=False):
+        """Takes requests and tokens from the model's buckets if both have them.
+
+        Returns 0 on success, or the number of seconds until they would. With
+        force, the buckets are charged regardless and may go into debt; a
+        negative token count returns tokens to the bucket.
+        """
+        capacity = (
+            max(1.0, self.requests_per_second * BURST_SECONDS),
+            max(tokens, self.tokens_per_second * BURST_SECONDS),
+        )
+        fd = os.open(self._state_path(model), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            now = time.time()
+            data = os.pread(fd, struct.calcsize(STATE_FORMAT), 0)
+            if len(data) == struct.calcsize(STATE_FORMAT):
+                request_level, token_level, updated = struct.unpack(STATE_FORMAT, data)
+                elapsed = max(0.0, now - updated)
+                request_level = min(
+                    capacity[0], request_level + elapsed * self.requests_per_second
+                )
+                token_level = min(
+                    capacity[1], token_level + elapsed * self.tokens_per_second
+                )
+            else:
+                request_level, token_level = capacity
+            wait = 0.0
+            if not force:
+                if self.requests_per_second and request_level < requests:
+                    wait = (requests - request_level) / self.requests_per_second
+                if self.tokens_per_second and token_level < tokens:
+                    wait = max(wait, (tokens - token_level) / self.tokens_per_second)
+            if wait == 0.0:
+                request_level -= requests
+                token_level = min(capacity[1], token_level - tokens)
+            os.pwrite(fd, struct.pack(STATE_FORMAT, request_level, token_level, now), 0)
+            return wait
+        finally:
+            os.close(fd)
+
+    def acquire(self, model, tokens):
+        while (wait := self._update(model, 1, tokens)) > 0:
+            time.sleep(wait)
+
+    def call(self, bucket, create, *args, **kwargs):
+        """Makes the call create(*args, **kwargs) against the named bucket."""
+        estimate = estimate_tokens(self.count_tokens, kwargs)
+        self.acquire(bucket, estimate)
+        response = create(*args, **kwargs)
+        usage = getattr(response, "usage", None)
+        if usage is not None and self.tokens_per_second:
+            self._update(bucket, 0, usage.total_tokens - estimate, force=True)
+        return response
+
+    def middleware(self, create):
+        def rate_limited_create(*args, **kwargs):
+            return self.call(kwargs.get("model", "default"), create, *args, **kwargs)
+
+        return rate_limited_create
@@ -0,0 +1,64 @@
+import json
+import os
+import threading
+import time
+
+from src.utils import load_skip_journal
+
+
+class ResultSink:
+    """Streams per-row outcomes to disk as they complete.
+
+    Successful rows are appended to results.jsonl and skips to
+    skips.journal.jsonl, one line each, flushed right away so other tools can
+    tail a run in progress. fsync is only issued every fsync_interval seconds.
+    skips.json is derived from the journal on close.
+    """
+
+    def __init__(self, path_prefix, skip_logs, fsync_interval=5.0):
+        self.path_prefix = path_prefix
+        self.skip_logs = skip_logs
+        self.fsync_interval = fsync_interval
+        self.results_file = open(os.path.join(path_prefix, "results.jsonl"), "w")
+        self.journal_path = os.path.join(path_prefix, "skips.journal.jsonl")
+        self.journal_file = open(self.journal_path, "w")
+        # A skips.json left by an earlier run would shadow the journal for readers.
+        skips_path = os.path.join(path_prefix, "skips.json")
+        if os.path.exists(skips_path):
+            os.remove(skips_path)
+        self.lock = threading.Lock()
+        self.last_sync = time.monotonic()
+
+    def write(self, result):
+        with self.lock:
+            if result.get("skipped_reason"):
+                entry = {
+                    "question_id": result["question_id"],
+                    "reason": result["skipped_reason"],
+                }
+                self.journal_file.write(json.dumps(entry) + "\n")
+                self.journal_file.flush()
+            else:
+                result = {k: v for k, v in result.items() if k != "skipped_reason"}
+                self.results_file.write(json.dumps(result) + "\n")
+                self.results_file.flush()
+            if time.monotonic() - self.last_sync >= self.fsync_interval:
+                self._sync()
+
+    def _sync(self):
+        os.fsync(self.results_file.fileno())
+        os.fsync(self.journal_file.fileno())
+        self.last_sync = time.monotonic()
+
+    def close(self):
+        print("done with all runs, saving aggregated results.")
+        with self.lock:
+            self._sync()
+            self.results_file.close()
+            self.journal_file.close()
+        skip_logs = {k: list(v) for k, v in self.skip_logs.items()}
+        for reason, qids in load_skip_journal(self.journal_path).items():
+            skip_logs.setdefault(reason, []).extend(qids)
+        with open(os.path.join(self.path_prefix, "skips.json"), "w") as skipped_file:
+            json.dump(skip_logs, skipped_file)
+            skipped_file.write("\n")
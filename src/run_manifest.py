@@ -0,0 +1,66 @@
+import json
+import os
+import time
+
+CREATED = "created"
+ASSIGNED = "assigned"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+# Skip reasons that are decided up front rather than caused by a failed LLM call.
+PLANNED_SKIP_REASONS = {"multi_turn", "sampling"}
+
+
+class RunManifest:
+    """Append-only JSONL log of per-question progress in a nuggetize_responses run.
+
+    Every state change is a single line, so the latest line per question_id is its
+    current state. A truncated trailing line from a killed run is ignored on load.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def reset(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def record(self, question_id, state, reason=None, error=None):
+        entry = {
+            "question_id": int(question_id),
+            "state": state,
+            "reason": reason,
+            "error": error,
+            "time": time.time(),
+        }
+        line = (json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8")
+        # One O_APPEND write per entry keeps lines intact across worker processes.
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+
+    def record_result(self, result):
+        reason = result.get("skipped_reason")
+        if not reason:
+            self.record(result["question_id"], ASSIGNED)
+        elif reason in PLANNED_SKIP_REASONS:
+            self.record(result["question_id"], SKIPPED, reason=reason)
+        else:
+            self.record(
+                result["question_id"], FAILED, reason=reason, error=result.get("error")
+            )
+
+    def load(self):
+        states = {}
+        if not os.path.exists(self.path):
+            return states
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                states[entry["question_id"]] = entry
+        return states
@@ -31,9 +31,41 @@ def get_prompt(row):
     return prompt
 
 
+def load_results(path_prefix):
+    results = []
+    with open(os.path.join(path_prefix, "results.jsonl"), "r") as f:
+        for l in f:
+            try:
+                results.append(json.loads(l))
+            except json.JSONDecodeError:
+                # The last line of a results file that is still being written.
+                continue
+    return results
+
+
+def load_skip_journal(journal_path):
+    skip_logs = {}
+    with open(journal_path, "r") as f:
+        for l in f:
+            try:
+                entry = json.loads(l)
+            except json.JSONDecodeError:
+                continue
+            skip_logs.setdefault(entry["reason"], []).append(entry["question_id"])
+    return skip_logs
+
+
+def load_skip_logs(path_prefix):
+    """Reads skips.json, or the skips journal of a run that is still going."""
+    skips_path = os.path.join(path_prefix, "skips.json")
+    if os.path.exists(skips_path):
+        with open(skips_path, "r") as f:
+            return json.load(f)
+    return load_skip_journal(os.path.join(path_prefix, "skips.journal.jsonl"))
+
+
 def load_skips(path_prefix):
-    with open(os.path.join(path_prefix, "skips.json"), "r") as f:
-        data = json.load(f)
+    data = load_skip_logs(path_prefix)
     return set(
         data.get("nugget_creation", [])
         + data.get("nugget_assignment", [])
@@ -7,8 +7,8 @@ import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 import seaborn as sns
-from datasets import load_dataset
 
+from src.dataset_snapshot import load_arena_df
 from src.utils import Metric
 
 
@@ -171,7 +171,7 @@ def main():
 
     os.makedirs(args.output_dir, exist_ok=True)
 
-    dataset_df = load_dataset("lmarena-ai/search-arena-v1-7k", split="test").to_pandas()
+    dataset_df = load_arena_df(["question_id", "language", "winner"])
     jsonl_df = pd.read_json(args.results_path, lines=True)
     merged_df = pd.merge(
         dataset_df, jsonl_df, on=["question_id", "winner"], how="inner"
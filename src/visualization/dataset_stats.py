@@ -3,7 +3,8 @@ import os
 
 import matplotlib.pyplot as plt
 import pandas as pd
-from datasets import load_dataset
+
+from src.dataset_snapshot import load_arena_df
 
 
 def get_turn_label(row):
@@ -13,7 +14,7 @@ def get_turn_label(row):
 
 
 def prepare_dataset_df():
-    input_df = load_dataset("lmarena-ai/search-arena-v1-7k", split="test").to_pandas()
+    input_df = load_arena_df(["turn", "language", "winner"])
     stats = []
     for _, row in input_df.iterrows():
         if row["turn"] > 1:
@@ -0,0 +1,177 @@
+import contextlib
+import json
+import os
+import sqlite3
+import time
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+
+class WorkQueue:
+    """Durable job table that any number of nuggetize_responses workers pull from.
+
+    Workers on one or several hosts share the SQLite file. A worker leases one
+    question at a time; if it crashes, the lease expires and another worker
+    picks the question up. Failed questions are retried until max_attempts,
+    and every job keeps its attempt count and last error. Once the table is
+    drained, exactly one worker claims the right to write the results.
+    """
+
+    def __init__(self, path, max_attempts=3):
+        self.path = path
+        self.max_attempts = max_attempts
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "question_id INTEGER PRIMARY KEY, start_stage TEXT, status TEXT, "
+                "worker TEXT, lease_expires REAL, attempts INTEGER DEFAULT 0, "
+                "skipped_reason TEXT, last_error TEXT, result TEXT)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS finalized ("
+                "id INTEGER PRIMARY KEY CHECK (id = 1), worker TEXT, finalized_at REAL)"
+            )
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # Each call gets its own connection, so threads never share one.
+        conn = sqlite3.connect(self.path, timeout=120, isolation_level=None)
+        try:
+            # WAL needs shared memory between the processes and does not work on
+            # the network filesystems that workers on several hosts share.
+            conn.execute("PRAGMA journal_mode=DELETE")
+            yield conn
+        finally:
+            conn.close()
+
+    def populate(self, jobs, skips):
+        """Adds (question_id, start_stage) jobs and up-front skips.
+
+        Questions already in the table are left untouched, so every worker can
+        call this on startup. Adding new questions reopens a finalized table.
+        """
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            added = conn.executemany(
+                "INSERT OR IGNORE INTO jobs (question_id, start_stage, status) "
+                "VALUES (?, ?, ?)",
+                [(int(qid), stage, PENDING) for qid, stage in jobs],
+            ).rowcount
+            added += conn.executemany(
+                "INSERT OR IGNORE INTO jobs (question_id, status, skipped_reason) "
+                "VALUES (?, ?, ?)",
+                [(int(qid), SKIPPED, reason) for qid, reason in skips],
+            ).rowcount
+            if added:
+                conn.execute("DELETE FROM finalized")
+            conn.execute("COMMIT")
+
+    def lease(self, worker, lease_seconds):
+        """Returns (question_id, start_stage) of a leased job, or None if none is left."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "UPDATE jobs SET status = ?, skipped_reason = 'lease_expired', "
+                "last_error = 'lease expired' "
+                "WHERE status = ? AND lease_expires < ? AND attempts >= ?",
+                (FAILED, LEASED, now, self.max_attempts),
+            )
+            job = conn.execute(
+                "SELECT question_id, start_stage FROM jobs "
+                "WHERE status = ? OR (status = ? AND lease_expires < ?) "
+                "ORDER BY attempts, question_id LIMIT 1",
+                (PENDING, LEASED, now),
+            ).fetchone()
+            if job is not None:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, worker = ?, lease_expires = ?, "
+                    "attempts = attempts + 1 WHERE question_id = ?",
+                    (LEASED, worker, now + lease_seconds, job[0]),
+                )
+            conn.execute("COMMIT")
+        return job
+
+    def finish(self, question_id, worker, result, retry_stage):
+        """Stores a worker's result for a job it still holds the lease on.
+
+        A failed row goes back to pending, restarting at retry_stage, until it
+        has used up max_attempts.
+        """
+        reason = result.get("skipped_reason")
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            attempts = conn.execute(
+                "SELECT attempts FROM jobs WHERE question_id = ? AND status = ? "
+                "AND worker = ?",
+                (int(question_id), LEASED, worker),
+            ).fetchone()
+            if attempts is None:
+                # The lease expired and the job moved on to another worker.
+                conn.execute("COMMIT")
+                return
+            if not reason:
+                result = {k: v for k, v in result.items() if k != "skipped_reason"}
+                conn.execute(
+                    "UPDATE jobs SET status = ?, result = ? WHERE question_id = ?",
+                    (DONE, json.dumps(result), int(question_id)),
+                )
+            elif attempts[0] < self.max_attempts:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, start_stage = ?, last_error = ? "
+                    "WHERE question_id = ?",
+                    (PENDING, retry_stage, result.get("error"), int(question_id)),
+                )
+            else:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, skipped_reason = ?, last_error = ? "
+                    "WHERE question_id = ?",
+                    (FAILED, reason, result.get("error"), int(question_id)),
+                )
+            conn.execute("COMMIT")
+
+    def counts(self):
+        with self._connect() as conn:
+            return dict(
+                conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status")
+            )
+
+    def claim_finalization(self, worker):
+        """Whether worker is the one to write the results of the drained table.
+
+        Returns True for exactly one worker, and only once no job is pending or
+        leased anymore.
+        """
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            unfinished = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)", (PENDING, LEASED)
+            ).fetchone()[0]
+            claimed = not unfinished and (
+                conn.execute(
+                    "INSERT OR IGNORE INTO finalized (id, worker, finalized_at) "
+                    "VALUES (1, ?, ?)",
+                    (worker, time.time()),
+                ).rowcount
+                == 1
+            )
+            conn.execute("COMMIT")
+        return claimed
+
+    def collect(self):
+        """Yields the outcome of every finished job in process_row's result format."""
+        with self._connect() as conn:
+            for question_id, status, reason, result in conn.execute(
+                "SELECT question_id, status, skipped_reason, result FROM jobs "
+                "ORDER BY question_id"
+            ):
+                if status == DONE:
+                    yield {**json.loads(result), "skipped_reason": None}
+                elif status in (FAILED, SKIPPED):
+                    yield {"question_id": question_id, "skipped_reason": reason}
@@ -0,0 +1,41 @@
+from types import SimpleNamespace
+
+import pytest
+
+from src.llm_trace import CallTracer, read_trace
+
+
+def response():
+    return SimpleNamespace(usage=SimpleNamespace(prompt_tokens=3, completion_tokens=2))
+
+
+def test_consecutive_calls_on_one_thread(tmp_path):
+    tracer = CallTracer(str(tmp_path / "llm_trace.jsonl"))
+    create = tracer.middleware(lambda **request: response())
+    with tracer.context(question_id=1, stage="create"):
+        create(model="m", messages=[{"role": "user", "content": "a"}])
+        create(model="m", messages=[{"role": "user", "content": "b"}])
+    records = list(read_trace(tracer.path))
+    assert len(records) == 2
+    assert all(r["error"] is None and r["retries"] == 0 for r in records)
+    assert all(r["question_id"] == 1 and r["stage"] == "create" for r in records)
+
+
+def test_retries_of_the_same_request_are_counted(tmp_path):
+    tracer = CallTracer(str(tmp_path / "llm_trace.jsonl"))
+    outcomes = [ValueError("unparseable"), response()]
+
+    def flaky_create(**request):
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    create = tracer.middleware(flaky_create)
+    request = {"model": "m", "messages": [{"role": "user", "content": "a"}]}
+    with pytest.raises(ValueError):
+        create(**request)
+    create(**request)
+    failed, succeeded = read_trace(tracer.path)
+    assert (failed["error"], failed["retries"]) == ("ValueError", 0)
+    assert (succeeded["error"], succeeded["retries"]) == (None, 1)
@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+
+from src.planner import hash_unit_interval, plan_rows, shard_ids
+
+QUESTION_IDS = np.arange(20000)
+
+
+def test_salts_and_seeds_give_independent_values():
+    sampling = hash_unit_interval(QUESTION_IDS, 42, "sampling")
+    assert ((sampling >= 0) & (sampling < 1)).all()
+    assert not np.allclose(sampling, hash_unit_interval(QUESTION_IDS, 42, "swap"))
+    assert not np.allclose(sampling, hash_unit_interval(QUESTION_IDS, 7, "sampling"))
+    np.testing.assert_array_equal(
+        sampling, hash_unit_interval(QUESTION_IDS, 42, "sampling")
+    )
+
+
+def test_changing_the_seed_changes_the_sample():
+    data_df = pd.DataFrame({"question_id": QUESTION_IDS, "turn": 1})
+    sampled = [
+        set(plan.index[plan["skipped_reason"].isna()])
+        for plan in (plan_rows(data_df, 0.05, seed) for seed in [42, 7])
+    ]
+    assert sampled[0] != sampled[1]
+
+
+def test_sampled_rows_are_swapped_about_half_the_time():
+    data_df = pd.DataFrame({"question_id": QUESTION_IDS, "turn": 1})
+    plan = plan_rows(data_df, 0.05, 42)
+    planned = plan[plan["skipped_reason"].isna()]
+    assert 0.4 < planned["swap"].mean() < 0.6
+
+
+def test_sampled_rows_spread_over_all_shards():
+    data_df = pd.DataFrame({"question_id": QUESTION_IDS, "turn": 1})
+    sizes = [
+        plan_rows(data_df, 0.05, 42, shard_id, 3)["skipped_reason"].isna().sum()
+        for shard_id in range(3)
+    ]
+    assert min(sizes) > 0.8 * sum(sizes) / 3
+    assert np.bincount(shard_ids(QUESTION_IDS, 3)).min() > 0.9 * len(QUESTION_IDS) / 3
+
+
+def test_cascade_holdout_fraction_of_sampled_rows_matches_the_rate():
+    sampled = QUESTION_IDS[hash_unit_interval(QUESTION_IDS, 42, "sampling") < 0.2]
+    holdout = hash_unit_interval(sampled, 42, "cascade_holdout") < 0.3
+    assert 0.25 < holdout.mean() < 0.35
@@ -0,0 +1,33 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from src.work_queue import WorkQueue
+
+
+def finish_all(queue, worker):
+    while (job := queue.lease(worker, 60)) is not None:
+        result = {"question_id": job[0], "skipped_reason": None}
+        queue.finish(job[0], worker, result, job[1])
+
+
+def test_one_worker_finalizes_the_drained_table(tmp_path):
+    queue = WorkQueue(str(tmp_path / "jobs.sqlite"))
+    queue.populate([(1, "create"), (2, "create")], [(3, "sampling")])
+    assert not queue.claim_finalization("early")
+    finish_all(queue, "worker")
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        claims = list(executor.map(queue.claim_finalization, map(str, range(8))))
+    assert claims.count(True) == 1
+    assert not queue.claim_finalization("late")
+
+
+def test_new_jobs_reopen_a_finalized_table(tmp_path):
+    queue = WorkQueue(str(tmp_path / "jobs.sqlite"))
+    queue.populate([(1, "create")], [])
+    finish_all(queue, "worker")
+    assert queue.claim_finalization("worker")
+    queue.populate([(1, "create")], [])
+    finish_all(queue, "worker")
+    assert not queue.claim_finalization("worker")
+    queue.populate([(2, "create")], [])
+    finish_all(queue, "worker")
+    assert queue.claim_finalization("worker")